@@ -0,0 +1,161 @@
+# coding: utf8
+"""Shared helpers of the benchmarks: package loading and synthetic data.
+
+Everything here is deterministic for a given seed, so runs on the same
+machine are comparable.
+"""
+
+import os
+import sys
+import random
+import importlib.util
+import importlib.machinery
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, 'src')
+PACKAGE = 'shadowsocks_pygi'
+
+TLDS = ['com', 'net', 'org', 'io', 'co.uk', 'com.cn', 'cn', 'jp', 'de',
+        'com.hk', 'tw', 'info', 'blogspot.com', 'github.io', 'co.jp']
+WORDS = ['google', 'video', 'news', 'cloud', 'mail', 'shop', 'static',
+         'cdn', 'blog', 'api', 'media', 'img', 'search', 'chat', 'drive',
+         'music', 'photo', 'tube', 'book', 'wiki', 'forum', 'game', 'maps',
+         'login', 'store', 'docs', 'live', 'play', 'feed', 'dev']
+
+
+def load_package():
+    """Import the package from the source tree, without its ``__init__``.
+
+    The ``__init__`` pins Gtk through gi; the modules benchmarked here do
+    not need it, so they run on machines without the desktop stack.
+    """
+    if PACKAGE in sys.modules:
+        return sys.modules[PACKAGE]
+    spec = importlib.machinery.ModuleSpec(PACKAGE, None, is_package=True)
+    package = importlib.util.module_from_spec(spec)
+    package.__path__ = [SRC]
+    sys.modules[PACKAGE] = package
+    return package
+
+
+def module(name):
+    load_package()
+    return importlib.import_module(PACKAGE + '.' + name)
+
+
+class Settings(dict):
+    """The attribute access of ``config.ConfigItem``, without GLib."""
+
+    def __getattr__(self, key):
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError(key)
+
+
+def pac_settings(compress=False):
+    return Settings(
+        pac=Settings(
+            compress=compress,
+            local_gfwlist='',
+            direct_networks='',
+            proxy_networks='',
+        ),
+        local=Settings(address='127.0.0.1', port=1080),
+    )
+
+
+def synthetic_domain(rnd):
+    labels = [rnd.choice(WORDS) + str(rnd.randrange(1000))]
+    if rnd.random() < 0.3:
+        labels.insert(0, rnd.choice(WORDS))
+    return '.'.join(labels + [rnd.choice(TLDS)])
+
+
+def synthetic_gfwlist(n=5000, seed=1):
+    """Lines of a gfwlist in its usual mix of rule kinds."""
+    rnd = random.Random(seed)
+    lines = ['[AutoProxy 0.2.9]', '! Synthetic gfwlist, seed {}'.format(seed)]
+    while len(lines) < n:
+        domain = synthetic_domain(rnd)
+        kind = rnd.random()
+        if kind < 0.45:
+            lines.append('||' + domain)
+        elif kind < 0.60:
+            lines.append('.' + domain)
+        elif kind < 0.72:
+            lines.append('|http://{}/{}'.format(domain, rnd.choice(WORDS)))
+        elif kind < 0.80:
+            lines.append('{}/{}*'.format(domain, rnd.choice(WORDS)))
+        elif kind < 0.86:
+            lines.append('@@||' + domain)
+        elif kind < 0.90:
+            lines.append(
+                '/^https?:\\/\\/[^\\/]+' + domain.replace('.', '\\.') + '/'
+            )
+        elif kind < 0.95:
+            lines.append('*.{}/*'.format(domain))
+        else:
+            lines.append('! ' + rnd.choice(WORDS))
+    return lines
+
+
+def synthetic_hosts(n=10000, seed=2, rules=None, hit_rate=0.3):
+    """Host names to look up, ``hit_rate`` of them under ``rules``.
+
+    ``rules`` are domains, e.g. the parsed proxy list of a pac; hits get
+    a random subdomain so that suffix matching is exercised.
+    """
+    rnd = random.Random(seed)
+    rules = list(rules or [])
+    hosts = []
+    for _ in range(n):
+        if rules and rnd.random() < hit_rate:
+            domain = rnd.choice(rules)
+        else:
+            domain = synthetic_domain(rnd)
+        if rnd.random() < 0.6:
+            domain = rnd.choice(['www', 'm', 'static', 'api', 'a.b']) + \
+                '.' + domain
+        hosts.append(domain)
+    if n >= 10:
+        hosts[::97] = ['10.0.{}.{}'.format(i % 256, i % 200 + 1)
+                       for i in range(len(hosts[::97]))]
+    return hosts
+
+
+def synthetic_networks(n=8000, seed=3):
+    """CIDR ranges as in a country list, about a tenth of them IPv6."""
+    rnd = random.Random(seed)
+    networks = []
+    for _ in range(n):
+        if rnd.random() < 0.1:
+            prefix = rnd.randrange(32, 49)
+            networks.append('2{:03x}:{:x}::/{}'.format(
+                rnd.randrange(0x400), rnd.randrange(0x10000), prefix
+            ))
+        else:
+            prefix = rnd.randrange(12, 25)
+            networks.append('{}.{}.{}.0/{}'.format(
+                rnd.randrange(1, 224), rnd.randrange(256),
+                rnd.randrange(256), prefix
+            ))
+    return networks
+
+
+def synthetic_addresses(n=10000, seed=4):
+    """IPv4 and, a tenth of them, IPv6 addresses to look up."""
+    rnd = random.Random(seed)
+    addresses = []
+    for _ in range(n):
+        if rnd.random() < 0.1:
+            addresses.append('2{:03x}:{:x}::{:x}'.format(
+                rnd.randrange(0x400), rnd.randrange(0x10000),
+                rnd.randrange(0x10000)
+            ))
+        else:
+            addresses.append('{}.{}.{}.{}'.format(
+                rnd.randrange(1, 224), rnd.randrange(256),
+                rnd.randrange(256), rnd.randrange(1, 255)
+            ))
+    return addresses
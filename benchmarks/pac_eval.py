@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# coding: utf8
+"""Decision speed and parity of generated pac files.
+
+Every pac file is evaluated over one host corpus by up to three
+engines, and each is compared with the reference decisions:
+
+* ``python``: ``PacScript``, a line by line port of ``FindProxyForURL``
+  of the templates, fed with the rules and ranges of the file itself;
+* ``router``: ``router.Router`` built from the same rules, which is what
+  the http proxy decides with;
+* ``node``: the file itself, wrapped in a function, when ``node`` is
+  installed.
+
+By default both templates, plain and minified, are generated from a
+synthetic gfwlist; ``--pac`` evaluates existing files instead::
+
+    python3 benchmarks/pac_eval.py --hosts 50000
+    python3 benchmarks/pac_eval.py --pac ~/.config/shadowsocks-pygi/pac/*.pac
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import common
+
+# Replays a corpus through FindProxyForURL of each pac file, in node.
+NODE_RUNNER = r'''
+const fs = require('fs');
+const [hostsFile, rounds, ...pacFiles] = process.argv.slice(2);
+const hosts = JSON.parse(fs.readFileSync(hostsFile, 'utf8'));
+const results = {};
+for (const pacFile of pacFiles) {
+    // Wrapped in a function: globals of a vm context are slow to access
+    // and would dominate the timings.
+    const source = fs.readFileSync(pacFile, 'utf8');
+    const find = new Function(source + '\nreturn FindProxyForURL;')();
+    let decisions, best = Infinity;
+    for (let round = 0; round < +rounds; round++) {
+        const start = process.hrtime.bigint();
+        decisions = hosts.map(host => find('http://' + host + '/', host));
+        const seconds = Number(process.hrtime.bigint() - start) / 1e9;
+        best = Math.min(best, seconds);
+    }
+    results[pacFile] = {seconds: best, decisions: decisions};
+}
+process.stdout.write(JSON.stringify(results));
+'''
+
+
+class PacScript:
+    """``FindProxyForURL`` of ``pac-tpl.js``, ported statement by statement.
+
+    Kept deliberately naive, so that it documents what the template does
+    rather than how fast it could be done.
+    """
+
+    def __init__(self, rules, ranges, proxy):
+        self.rules = rules
+        self.ranges = ranges
+        self.proxy = proxy
+
+    @classmethod
+    def from_source(cls, source):
+        """Read the rules, ranges and proxy of a generated pac file."""
+        proxy = re.search(r'\bproxy\s*=\s*([\'"])(.*?)\1', source).group(2)
+        decoder = json.JSONDecoder()
+        tables = []
+        for name in ('rules', 'ranges'):
+            match = re.search(r'\b' + name + r'\s*=\s*(?=\[)', source)
+            if match is None:
+                tables.append([])
+                continue
+            tables.append(decoder.raw_decode(source, match.end())[0])
+        return cls(tables[0], tables[1], proxy)
+
+    def find_proxy_for_url(self, url, host):
+        ret = self.test_host(host, 0)
+        if ret is not None:
+            return ret
+        ret = self.test_ip(host)
+        if ret is not None:
+            return ret
+        for index in range(1, len(self.rules)):
+            ret = self.test_host(host, index)
+            if ret is not None:
+                return ret
+        return 'DIRECT'
+
+    def test_host(self, host, index):
+        for i, rules in enumerate(self.rules[index]):
+            for rule in rules:
+                if host == rule or host.endswith('.' + rule):
+                    return 'DIRECT' if i % 2 == 0 else self.proxy
+        return None
+
+    _ipv4 = re.compile(r'^\d+\.\d+\.\d+\.\d+$')
+
+    def test_ip(self, host):
+        if not self._ipv4.match(host):
+            return None
+        parts = [int(part) for part in host.split('.')]
+        ip = parts[0] * 16777216 + parts[1] * 65536 + parts[2] * 256 + \
+            parts[3]
+        for i, table in enumerate(self.ranges):
+            if self.in_ranges(ip, table):
+                return 'DIRECT' if i % 2 == 0 else self.proxy
+        return None
+
+    @staticmethod
+    def in_ranges(ip, table):
+        lo, hi = 0, len(table) // 2 - 1
+        while lo <= hi:
+            mid = (lo + hi) >> 1
+            if ip < table[2 * mid]:
+                hi = mid - 1
+            elif ip > table[2 * mid + 1]:
+                lo = mid + 1
+            else:
+                return True
+        return False
+
+
+def router_for(script):
+    """A ``Router`` deciding by the tables of ``script``, uncached."""
+    router = common.module('router')
+    cidr = common.module('cidr')
+
+    def ranges(flat):
+        import ipaddress
+        return cidr.CidrSet(
+            network
+            for start, end in zip(flat[0::2], flat[1::2])
+            for network in ipaddress.summarize_address_range(
+                ipaddress.IPv4Address(start), ipaddress.IPv4Address(end)
+            )
+        )
+    direct, proxy = (script.ranges + [[], []])[:2]
+    return router.Router(
+        [tuple(group) for group in script.rules], cache_size=0,
+        direct_ranges=ranges(direct), proxy_ranges=ranges(proxy)
+    ), router.PROXY
+
+
+def synthetic_pacs(directory, rules):
+    """Generate the plain and minified pac of a synthetic gfwlist."""
+    pac_module = common.module('pac')
+    cidr = common.module('cidr')
+    pac = pac_module.Pac(common.pac_settings())
+    pac.gfwlist = common.synthetic_gfwlist(rules)
+    pac.user_rules = ['@@' + line for line in pac.gfwlist[2:200:7]
+                      if line.startswith('||')] + \
+        [line for line in common.synthetic_gfwlist(100, seed=3)[2:]]
+    pac.direct_ranges = cidr.CidrSet(['10.0.0.0/18', '10.0.192.0/20'])
+    pac.proxy_ranges = cidr.CidrSet(['10.0.64.0/18'])
+    paths = []
+    for compress, name in ((False, 'pac-tpl.pac'), (True, 'pac-tpl.min.pac')):
+        pac.config.pac['compress'] = compress
+        pac.generate()
+        path = os.path.join(directory, name)
+        with open(path, 'w', encoding='utf8') as pac_file:
+            pac_file.write(pac._pac)
+        paths.append(path)
+    return paths
+
+
+def rate(count, seconds):
+    return count / seconds if seconds else float('inf')
+
+
+def best_of(rounds, func):
+    best, result = float('inf'), None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def evaluate(pacs, hosts, rounds, node):
+    results = []
+    reference = {}
+    for path in pacs:
+        with open(path, encoding='utf8') as pac_file:
+            script = PacScript.from_source(pac_file.read())
+        seconds, decisions = best_of(rounds, lambda: [
+            script.find_proxy_for_url('http://' + host + '/', host)
+            for host in hosts
+        ])
+        reference[path] = decisions
+        results.append((path, 'python', seconds, decisions))
+
+        router, proxy = router_for(script)
+        seconds, decisions = best_of(rounds, lambda: [
+            script.proxy if router.decide(host) == proxy else 'DIRECT'
+            for host in hosts
+        ])
+        results.append((path, 'router', seconds, decisions))
+
+    if node:
+        with tempfile.TemporaryDirectory() as directory:
+            runner = os.path.join(directory, 'runner.js')
+            hosts_file = os.path.join(directory, 'hosts.json')
+            with open(runner, 'w') as runner_file:
+                runner_file.write(NODE_RUNNER)
+            with open(hosts_file, 'w') as hosts_json:
+                json.dump(hosts, hosts_json)
+            output = subprocess.run(
+                [node, runner, hosts_file, str(rounds)] + list(pacs),
+                stdout=subprocess.PIPE, check=True, universal_newlines=True
+            ).stdout
+        for path, result in json.loads(output).items():
+            results.append(
+                (path, 'node', result['seconds'], result['decisions'])
+            )
+
+    first = reference[pacs[0]]
+    report = []
+    for path, engine, seconds, decisions in results:
+        mismatches = [
+            (host, expected, got)
+            for host, expected, got in zip(hosts, first, decisions)
+            if expected != got
+        ]
+        report.append(dict(
+            pac=path,
+            engine=engine,
+            seconds=seconds,
+            decisions_per_second=rate(len(hosts), seconds),
+            proxied=sum(1 for d in decisions if d != 'DIRECT'),
+            mismatches=len(mismatches),
+            examples=mismatches[:5],
+        ))
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--pac', nargs='+', help='generated pac files')
+    parser.add_argument('--rules', type=int, default=3000,
+                        help='lines of the synthetic gfwlist')
+    parser.add_argument('--hosts', type=int, default=5000)
+    parser.add_argument('--hosts-file',
+                        help='a host per line, instead of synthetic hosts')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--no-node', action='store_true')
+    parser.add_argument('-o', '--output', help='write the report as json')
+    args = parser.parse_args(argv)
+
+    node = None if args.no_node else shutil.which('node')
+    with tempfile.TemporaryDirectory() as directory:
+        pacs = args.pac or synthetic_pacs(directory, args.rules)
+        if args.hosts_file:
+            with open(args.hosts_file, encoding='utf8') as hosts_file:
+                hosts = [line.strip() for line in hosts_file if line.strip()]
+        else:
+            with open(pacs[0], encoding='utf8') as pac_file:
+                script = PacScript.from_source(pac_file.read())
+            domains = [d for group in script.rules for rules in group
+                       for d in rules]
+            hosts = common.synthetic_hosts(args.hosts, rules=domains)
+        report = evaluate(pacs, hosts, args.rounds, node)
+
+    print('{} hosts, reference: python on {}'.format(
+        len(hosts), os.path.basename(pacs[0])
+    ))
+    print('{:<24} {:<7} {:>14} {:>8} {:>11}'.format(
+        'pac', 'engine', 'decisions/s', 'proxied', 'mismatches'
+    ))
+    for row in report:
+        print('{:<24} {:<7} {:>14,.0f} {:>8} {:>11}'.format(
+            os.path.basename(row['pac']), row['engine'],
+            row['decisions_per_second'], row['proxied'], row['mismatches']
+        ))
+        for host, expected, got in row['examples']:
+            print('    {}: {} != {}'.format(host, got, expected))
+    if not node:
+        print('node not found, js engine skipped.')
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as output:
+            json.dump(dict(hosts=len(hosts), results=report), output,
+                      indent=2)
+    return 1 if any(row['mismatches'] for row in report) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
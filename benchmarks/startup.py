@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# coding: utf8
+"""Time from process start to the first window draw, or daemon loop.
+
+Runs ``shadowsocks-pygi --startup-time`` and, for the headless path,
+``shadowsocks-pygi-daemon --startup-time`` a few times, each in a fresh
+process, and prints the samples and their median in milliseconds::
+
+    python3 benchmarks/startup.py -n 5
+    python3 benchmarks/startup.py --only daemon
+
+The application needs a display, e.g. run it under ``xvfb-run``.
+"""
+
+import re
+import sys
+import argparse
+import statistics
+import subprocess
+
+COMMANDS = {
+    'app': [
+        sys.executable, '-c',
+        'import sys; sys.argv[1:] = ["--startup-time"]; '
+        'import shadowsocks_pygi; shadowsocks_pygi.main()'
+    ],
+    'daemon': [
+        sys.executable, '-m', 'shadowsocks_pygi.daemon', '--startup-time'
+    ],
+}
+# Log records are printed to stdout as well, before and after this line.
+STARTUP_TIME = re.compile(r'^startup-time: ([0-9.]+)$', re.MULTILINE)
+
+
+def measure(command, timeout=60):
+    output = subprocess.run(
+        command, stdout=subprocess.PIPE, timeout=timeout, check=True,
+        universal_newlines=True
+    ).stdout
+    match = STARTUP_TIME.search(output)
+    if match is None:
+        raise RuntimeError('No startup time in the output:\n' + output)
+    return float(match.group(1))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--runs', type=int, default=5)
+    parser.add_argument('--only', choices=sorted(COMMANDS))
+    args = parser.parse_args(argv)
+    for name, command in sorted(COMMANDS.items()):
+        if args.only and name != args.only:
+            continue
+        samples = [measure(command) * 1000 for _ in range(args.runs)]
+        print('{}: {}, median {:.0f}ms'.format(
+            name,
+            ' '.join('{:.0f}ms'.format(sample) for sample in samples),
+            statistics.median(samples)
+        ))
+
+
+if __name__ == '__main__':
+    main()
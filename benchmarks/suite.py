@@ -0,0 +1,512 @@
+#!/usr/bin/env python3
+# coding: utf8
+"""Offline benchmarks of the rule, pac, config and ping code paths.
+
+Every case runs ``repeat`` times and the median is kept. Results are
+written as json, and compared against a saved baseline, if any::
+
+    python3 benchmarks/suite.py --save-baseline    # on the reference tree
+    python3 benchmarks/suite.py                    # later, flags regressions
+
+The exit status is 1 when a case got slower than the baseline by more
+than ``--tolerance``. No network is used: gfwlists and hosts are
+synthetic, pings go to local listeners.
+"""
+
+import os
+import sys
+import json
+import atexit
+import time
+import socket
+import shutil
+import platform
+import argparse
+import ipaddress
+import http.client
+import http.server
+import tempfile
+import threading
+import statistics
+import subprocess
+
+import common
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, 'baseline.json')
+PSL_FILE = os.path.join(common.SRC, 'resources', 'public_suffix_list.dat')
+
+CASES = []
+
+
+class Skip(Exception):
+    pass
+
+
+def case(name, repeat=5, number=1):
+    """Register ``setup(args)``, which returns the callable to time."""
+    def decorator(setup):
+        CASES.append((name, setup, repeat, number))
+        return setup
+    return decorator
+
+
+def gfwlist(args):
+    if args.gfwlist:
+        with open(args.gfwlist, encoding='utf8') as gfwlist_file:
+            content = gfwlist_file.read()
+        if not content.lstrip().startswith('['):
+            import base64
+            content = base64.b64decode(content).decode('utf8')
+        return content.splitlines()
+    return common.synthetic_gfwlist(args.rules)
+
+
+def psl_text():
+    with open(PSL_FILE, encoding='utf8') as psl_file:
+        return psl_file.read()
+
+
+@case('psl.build', repeat=3)
+def psl_build(args):
+    """Build the list as ``RuleParser.psl`` is built.
+
+    The application passes the text of the file, not its lines, so the
+    list is fed character by character; that is what is timed here.
+    """
+    psl = common.module('publicsuffix')
+    text = psl_text()
+    return lambda: psl.PublicSuffixList(text)
+
+
+@case('psl.lookup')
+def psl_lookup(args):
+    """Lookups in the list ``RuleParser.surmise_domain`` uses."""
+    psl = common.module('publicsuffix')
+    suffixes = psl.PublicSuffixList(psl_text())
+    hosts = common.synthetic_hosts(args.hosts)
+
+    def lookup():
+        for host in hosts:
+            suffixes.get_public_suffix(host)
+    return lookup
+
+
+@case('rules.surmise_domain')
+def surmise_domain(args):
+    rule_parser = common.module('pac').RuleParser
+    rules = [line.lstrip('|@.') for line in gfwlist(args)
+             if line and not line.startswith(('!', '['))]
+
+    def surmise():
+        for rule in rules:
+            rule_parser.surmise_domain(rule)
+    return surmise
+
+
+@case('pac.parse_rules')
+def parse_rules(args):
+    pac = common.module('pac').Pac(common.pac_settings())
+    lines = gfwlist(args)
+    return lambda: pac.parse_rules(lines)
+
+
+@case('pac.generate')
+def generate(args):
+    pac_module = common.module('pac')
+    lines = gfwlist(args)
+
+    def generate():
+        # Parse from scratch, not from the gfwlist of the last run.
+        pac_module.Pac._gfwlist_cache = (None, None)
+        pac = pac_module.Pac(common.pac_settings())
+        pac.gfwlist = lines
+        pac.generate()
+    return generate
+
+
+@case('pac.generate.cached')
+def generate_cached(args):
+    pac_module = common.module('pac')
+    lines = gfwlist(args)
+
+    def generate():
+        pac = pac_module.Pac(common.pac_settings())
+        pac.gfwlist = lines
+        pac.generate()
+    generate()
+    return generate
+
+
+@case('ping.local', repeat=5)
+def ping_local(args):
+    ping = common.module('ping')
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(128)
+    port = listener.getsockname()[1]
+
+    def accept():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            conn.close()
+    threading.Thread(target=accept, daemon=True).start()
+
+    def run():
+        for _ in range(args.pings):
+            ping.Ping('127.0.0.1', port, timeout=1).ping(count=4)
+    return run
+
+
+@case('cidr.load', repeat=3)
+def cidr_load(args):
+    """Read and collapse a country sized list, as ``Pac.fetch_ranges``."""
+    cidr = common.module('cidr')
+    fd, path = tempfile.mkstemp(prefix='ss-bench-', suffix='.txt')
+    atexit.register(os.remove, path)
+    with open(fd, 'w') as networks_file:
+        networks_file.write('\n'.join(
+            common.synthetic_networks(args.networks)
+        ))
+    return lambda: cidr.CidrSet.from_file(path)
+
+
+@case('cidr.contains')
+def cidr_contains(args):
+    """``--hosts`` membership tests of parsed addresses."""
+    cidr = common.module('cidr')
+    ranges = cidr.CidrSet(common.synthetic_networks(args.networks))
+    addresses = [ipaddress.ip_address(a)
+                 for a in common.synthetic_addresses(args.hosts)]
+
+    def contains():
+        for address in addresses:
+            address in ranges
+    return contains
+
+
+@case('router.decide')
+def router_decide(args):
+    """Uncached decisions for a mix of host names and addresses.
+
+    Names go through the gfwlist rules, addresses through the ranges,
+    as in the http proxy; the decision cache is disabled.
+    """
+    pac = common.module('pac').Pac(common.pac_settings())
+    direct, proxy = pac.parse_rules(gfwlist(args))
+    router = common.module('router').Router(
+        [([], []), (direct, proxy)],
+        cache_size=0,
+        direct_ranges=common.module('cidr').CidrSet(
+            common.synthetic_networks(args.networks)
+        )
+    )
+    hosts = common.synthetic_hosts(args.hosts, rules=proxy)
+    hosts[::2] = common.synthetic_addresses(len(hosts[::2]))
+
+    def decide():
+        for host in hosts:
+            router.decide(host)
+    return decide
+
+
+def log_setup(args):
+    """A logger set up by ``logger.setup``, writing to a temporary file."""
+    logger = common.module('logger')
+    fd, path = tempfile.mkstemp(prefix='ss-bench-', suffix='.log')
+    os.close(fd)
+    atexit.register(os.remove, path)
+    logger.setup({
+        'version': 1,
+        'disable_existing_loggers': False,
+        'formatters': {'line': {
+            'format': '%(asctime)s %(levelname)s %(name)s %(message)s'
+        }},
+        'handlers': {'file': {
+            'class': 'logging.FileHandler',
+            'filename': path,
+            'formatter': 'line',
+        }},
+        'root': {'handlers': ['file']},
+    }, level='INFO')
+    return logger.logging.getLogger(common.PACKAGE + '.bench')
+
+
+@case('logging.disabled')
+def logging_disabled(args):
+    """``--records`` debug calls below the level, with a large argument."""
+    log = log_setup(args)
+    servers = {'server-{}'.format(n): n for n in range(200)}
+
+    def disabled():
+        for _ in range(args.records):
+            log.debug('Servers: %s', servers)
+    return disabled
+
+
+@case('logging.disabled.eager')
+def logging_disabled_eager(args):
+    """As ``logging.disabled``, formatting the message before the call."""
+    log = log_setup(args)
+    servers = {'server-{}'.format(n): n for n in range(200)}
+
+    def disabled():
+        for _ in range(args.records):
+            log.debug('Servers: {}'.format(servers))
+    return disabled
+
+
+@case('logging.enabled')
+def logging_enabled(args):
+    """``--records`` info calls, timed in the calling thread only."""
+    log = log_setup(args)
+
+    def enabled():
+        for n in range(args.records):
+            log.info('Request %s to %s:%s', n, 'example.com', 443)
+    return enabled
+
+
+class _Origin(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    body = b'x' * 512
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _DirectRouter:
+
+    def is_direct(self, host):
+        return True
+
+
+@case('httpproxy.forward', repeat=5)
+def httpproxy_forward(args):
+    """Plain http requests through the proxy to a local origin.
+
+    The router sends everything direct, so no socks server is needed;
+    requests are made on one keep-alive connection, as browsers do.
+    """
+    httpproxy = common.module('httpproxy')
+    origin = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Origin)
+    origin.daemon_threads = True
+    threading.Thread(target=origin.serve_forever, daemon=True).start()
+    proxy = httpproxy.HTTPProxy(common.Settings(local=common.Settings(
+        address='127.0.0.1', port=1, http_port=0, http_timeout=5
+    )))
+    proxy.set_router(_DirectRouter())
+    proxy.start()
+    url = 'http://127.0.0.1:{}/'.format(origin.server_address[1])
+
+    def run():
+        conn = http.client.HTTPConnection(*proxy.address, timeout=5)
+        for _ in range(args.requests):
+            conn.request('GET', url)
+            conn.getresponse().read()
+        conn.close()
+    return run
+
+
+def config_worker(servers, repeat):
+    """Time ``load_configures`` in this process, with a private home.
+
+    Runs in a child process: the config module loads itself on import,
+    from the directories of ``XDG_CONFIG_HOME`` and ``XDG_CACHE_HOME``.
+    """
+    config = common.module('config')
+    cold, warm = [], []
+    for _ in range(repeat):
+        try:
+            os.remove(config.Configure.snapshot_file)
+        except FileNotFoundError:
+            pass
+        start = time.perf_counter()
+        config.Configure().load_configures()
+        cold.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        config.Configure().load_configures()
+        warm.append(time.perf_counter() - start)
+    print(json.dumps({'config.load_configures': cold,
+                      'config.load_configures.snapshot': warm}))
+
+
+def run_config(args):
+    home = tempfile.mkdtemp(prefix='ss-bench-')
+    try:
+        servers = os.path.join(home, 'config', 'shadowsocks-pygi', 'servers')
+        os.makedirs(servers)
+        for n in range(args.servers):
+            with open(os.path.join(servers, 'server-{}.json'.format(n)),
+                      'w', encoding='utf8') as server_file:
+                json.dump(dict(
+                    server='10.0.{}.{}'.format(n // 250, n % 250 + 1),
+                    server_port=8388 + n % 100,
+                    password='password{}'.format(n),
+                    method='aes-256-cfb',
+                    timeout=300,
+                    fast_open=False,
+                    enabled=n % 10 == 0
+                ), server_file)
+        env = dict(
+            os.environ,
+            XDG_CONFIG_HOME=os.path.join(home, 'config'),
+            XDG_CACHE_HOME=os.path.join(home, 'cache'),
+            XDG_RUNTIME_DIR=home
+        )
+        output = subprocess.run(
+            [sys.executable, __file__, '--config-worker',
+             '--servers', str(args.servers), '--repeat', str(args.repeat)],
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True
+        )
+        if output.returncode != 0:
+            raise Skip(output.stderr.strip().splitlines()[-1])
+        return json.loads(output.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+
+def summarize(samples, number=1):
+    samples = [s / number for s in samples]
+    return dict(
+        median=statistics.median(samples),
+        min=min(samples),
+        max=max(samples),
+        repeat=len(samples),
+    )
+
+
+def run(args):
+    def wanted(name):
+        return not args.only or any(name.startswith(o) for o in args.only)
+
+    results = {}
+    skipped = {}
+    for name, setup, repeat, number in CASES:
+        if not wanted(name):
+            continue
+        try:
+            func = setup(args)
+        except (Skip, ImportError) as e:
+            skipped[name] = str(e)
+            continue
+        samples = []
+        for _ in range(args.repeat or repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            samples.append(time.perf_counter() - start)
+        results[name] = summarize(samples, number)
+
+    if wanted('config.load_configures'):
+        try:
+            for name, samples in run_config(args).items():
+                results[name] = summarize(samples)
+        except Skip as e:
+            skipped['config.load_configures'] = str(e)
+    return results, skipped
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    print('{:<34} {:>10} {:>10} {:>8}'.format(
+        'case', 'median ms', 'base ms', 'change'
+    ))
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        line = '{:<34} {:>10.2f}'.format(name, result['median'] * 1000)
+        if base:
+            change = result['median'] / base['median'] - 1
+            line += ' {:>10.2f} {:>+7.1%}'.format(base['median'] * 1000, change)
+            if change > tolerance:
+                regressions.append(name)
+                line += '  REGRESSION'
+        print(line)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--gfwlist', help='a gfwlist file, plain or base64; '
+                        'a synthetic one by default')
+    parser.add_argument('--rules', type=int, default=5000,
+                        help='lines of the synthetic gfwlist')
+    parser.add_argument('--hosts', type=int, default=10000)
+    parser.add_argument('--servers', type=int, default=500,
+                        help='server files for load_configures')
+    parser.add_argument('--networks', type=int, default=8000,
+                        help='CIDR ranges of the cidr and router cases')
+    parser.add_argument('--pings', type=int, default=20)
+    parser.add_argument('--records', type=int, default=10000,
+                        help='log calls per logging run')
+    parser.add_argument('--requests', type=int, default=500,
+                        help='http requests per httpproxy run')
+    parser.add_argument('--repeat', type=int, default=0,
+                        help='runs per case, overriding the case default')
+    parser.add_argument('--only', nargs='*', help='case name prefixes')
+    parser.add_argument('-o', '--output', help='write results json here')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown, 0.2 is 20%%')
+    parser.add_argument('--config-worker', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.config_worker:
+        return config_worker(args.servers, args.repeat or 5)
+
+    results, skipped = run(args)
+    document = dict(
+        created=time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        python=platform.python_version(),
+        machine=platform.platform(),
+        parameters=dict(rules=args.rules, hosts=args.hosts,
+                        servers=args.servers, pings=args.pings,
+                        gfwlist=args.gfwlist),
+        results=results,
+        skipped=skipped,
+    )
+
+    baseline = {}
+    if os.path.isfile(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding='utf8') as baseline_file:
+            baseline_document = json.load(baseline_file)
+        if baseline_document.get('parameters') != document['parameters']:
+            print('Baseline was run with other parameters, not comparing.')
+        else:
+            baseline = baseline_document['results']
+    regressions = compare(results, baseline, args.tolerance)
+    for name, reason in sorted(skipped.items()):
+        print('{:<34} skipped: {}'.format(name, reason))
+
+    for path in filter(None, (args.output,
+                              args.baseline if args.save_baseline else None)):
+        with open(path, 'w', encoding='utf8') as output:
+            json.dump(document, output, indent=2, sort_keys=True)
+        print('Results written to {}'.format(path))
+    if regressions:
+        print('{} regression(s): {}'.format(
+            len(regressions), ', '.join(regressions)
+        ))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -38,6 +38,9 @@ setup(
     entry_points={
         'gui_scripts': [
             'shadowsocks-pygi = shadowsocks_pygi:main',
+        ],
+        'console_scripts': [
+            'shadowsocks-pygi-daemon = shadowsocks_pygi.daemon:main',
         ]
     }
 )
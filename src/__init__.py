@@ -9,8 +9,9 @@ gi.require_versions({
     'Gio': '2.0'
 })
 
-from .shadowsocks import Shadowsocks
 
 def main():
+    # Imported here, so that the headless daemon never loads Gtk.
+    from .shadowsocks import Shadowsocks
     app = Shadowsocks()
     app.run(sys.argv)
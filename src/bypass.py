@@ -0,0 +1,84 @@
+# coding: utf8
+
+import logging
+import ipaddress
+
+from .router import Router
+
+logger = logging.getLogger(__name__)
+
+LOCAL_HOSTS = ['localhost']
+PRIVATE_NETWORKS = [
+    '0.0.0.0/8', '10.0.0.0/8', '100.64.0.0/10', '127.0.0.0/8',
+    '169.254.0.0/16', '172.16.0.0/12', '192.168.0.0/16',
+    '::1/128', 'fc00::/7', 'fe80::/10',
+]
+
+
+def collapse_networks(networks):
+    """Merge adjacent and overlapping ranges, IPv4 before IPv6."""
+    v4, v6 = [], []
+    for network in networks:
+        network = ipaddress.ip_network(network, strict=False)
+        (v4 if network.version == 4 else v6).append(network)
+    return [str(n) for n in ipaddress.collapse_addresses(v4)] + \
+        [str(n) for n in ipaddress.collapse_addresses(v6)]
+
+
+def collapse_domains(domains):
+    """Drop every domain which is a subdomain of another one in the set."""
+    collapsed = []
+    covered = set()
+    for labels in sorted(d.lower().strip('.').split('.')[::-1]
+                         for d in domains if d):
+        if any('.'.join(labels[:i]) in covered
+               for i in range(1, len(labels))):
+            continue
+        domain = '.'.join(labels)
+        covered.add(domain)
+        collapsed.append('.'.join(labels[::-1]))
+    return collapsed
+
+
+def bypass_domains(groups):
+    """Direct domains of the pac rule groups that are safe to bypass.
+
+    A domain is kept only if the pac decides it direct and no proxied
+    domain lives under it, since ignore-hosts bypasses whole subtrees.
+    """
+    router = Router(groups)
+    proxied = set()
+    direct = set()
+    for direct_lst, proxy_lst in groups:
+        proxied.update(proxy_lst)
+        direct.update(direct_lst)
+
+    parents = {}
+    for domain in proxied:
+        for suffix in Router.suffixes(domain)[1:]:
+            parents[suffix] = True
+    # Filter before collapsing: a parent dropped here must not hide its
+    # direct subdomains.
+    return collapse_domains(
+        domain for domain in direct
+        if router.is_direct(domain) and domain not in parents
+    )
+
+
+def compile_ignore_hosts(groups=(), networks=PRIVATE_NETWORKS, limit=None):
+    """Build a short ignore-hosts list for manual proxy mode.
+
+    ``groups`` are the ``(direct, proxy)`` rule groups of a pac, networks
+    are CIDR ranges to bypass. When ``limit`` is given, the list is cut to
+    that many entries, keeping local hosts and networks first.
+    """
+    hosts = list(LOCAL_HOSTS) + collapse_networks(networks)
+    for domain in bypass_domains(groups):
+        hosts.append(domain)
+        hosts.append('*.' + domain)
+    if limit and len(hosts) > limit:
+        logger.warning(
+            'Ignore hosts cut from %s to %s entries', len(hosts), limit
+        )
+        hosts = hosts[:limit]
+    return hosts
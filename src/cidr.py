@@ -0,0 +1,70 @@
+# coding: utf8
+
+import ipaddress
+
+from bisect import bisect_right
+
+
+def load_networks(path):
+    """CIDR ranges of a text file, one per line, '#' starts a comment."""
+    networks = []
+    with open(path) as cidr_file:
+        for line in cidr_file:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                networks.append(line)
+    return networks
+
+
+class CidrSet:
+    """A set of IPv4 and IPv6 ranges with O(log n) membership tests.
+
+    Ranges are collapsed and kept as sorted, non-overlapping arrays of
+    integer starts and ends per address family.
+    """
+
+    def __init__(self, networks=()):
+        self._starts = {4: [], 6: []}
+        self._ends = {4: [], 6: []}
+        by_version = {4: [], 6: []}
+        for network in networks:
+            network = ipaddress.ip_network(network, strict=False)
+            by_version[network.version].append(network)
+        for version, nets in by_version.items():
+            for network in ipaddress.collapse_addresses(nets):
+                self._starts[version].append(int(network.network_address))
+                self._ends[version].append(int(network.broadcast_address))
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(load_networks(path))
+
+    def __len__(self):
+        return len(self._starts[4]) + len(self._starts[6])
+
+    def __bool__(self):
+        return bool(self._starts[4] or self._starts[6])
+
+    def __contains__(self, address):
+        if isinstance(address, str):
+            try:
+                address = ipaddress.ip_address(address)
+            except ValueError:
+                return False
+        return self.contains_int(int(address), address.version)
+
+    def contains_int(self, value, version=4):
+        starts = self._starts[version]
+        i = bisect_right(starts, value) - 1
+        return i >= 0 and value <= self._ends[version][i]
+
+    def intervals(self, version=4):
+        return list(zip(self._starts[version], self._ends[version]))
+
+    def flat(self, version=4):
+        """``[start0, end0, start1, end1, ...]``, the pac table layout."""
+        flat = []
+        for start, end in self.intervals(version):
+            flat.append(start)
+            flat.append(end)
+        return flat
@@ -20,11 +20,21 @@ import os
 import json
 import yaml
 import shutil
+import logging
+import tempfile
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
 
 from gi.repository import GLib
 
 GFWLIST = 'https://raw.githubusercontent.com/gfwlist/gfwlist/master/gfwlist.txt'
 FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+SNAPSHOT_VERSION = 1
+
+YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+_UNPARSED = object()
 
 
 class ConfigItem(dict):
@@ -43,29 +53,317 @@ class ConfigItem(dict):
         return json.dumps(self, indent=2)
 
 
+class LazyConfigItem(ConfigItem):
+    """A ConfigItem whose values stay raw json text until first accessed."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        object.__setattr__(self, '_raw', {})
+
+    def load_raw(self, raw):
+        self.clear()
+        self._raw.clear()
+        for key, text in raw.items():
+            dict.__setitem__(self, key, _UNPARSED)
+            self._raw[key] = text
+
+    def raw(self, key):
+        """The json text of ``key``, without parsing it when possible."""
+        if key in self._raw:
+            return self._raw[key]
+        return json.dumps(self[key])
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if value is _UNPARSED:
+            value = ConfigItem(json.loads(self._raw.pop(key)))
+            dict.__setitem__(self, key, value)
+        return value
+
+    def __setitem__(self, key, value):
+        self._raw.pop(key, None)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._raw.pop(key, None)
+        dict.__delitem__(self, key)
+
+    def __iter__(self):
+        # Not the iterator of dict itself, so that dict(self) and
+        # {**self} read values through __getitem__, parsing them.
+        return dict.__iter__(self)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def copy(self):
+        """A shallow copy, keeping unparsed values unparsed."""
+        copy = type(self)()
+        dict.update(copy, dict.items(self))
+        copy._raw.update(self._raw)
+        return copy
+
+    def clear(self):
+        self._raw.clear()
+        dict.clear(self)
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def pop(self, key, *default):
+        if key not in self:
+            return dict.pop(self, key, *default)
+        value = self[key]
+        del self[key]
+        return value
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+
+class WriteBehind:
+    """Coalesces config writes and flushes them in one batch.
+
+    Sections marked dirty are serialized on the main loop once nothing
+    was marked for ``delay`` milliseconds, and written by a single worker
+    thread, so batches land in the order they were collected; every file
+    is replaced atomically.
+    """
+
+    def __init__(self, config, delay=500):
+        self.logger = logging.getLogger(__name__)
+        self.config = config
+        self.delay = delay
+
+        self._lock = threading.Lock()
+        self._dirty = set()
+        self._queued = set()
+        self._written = {}
+        self._source = None
+        self._executor = None
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(1)
+            return self._executor
+
+    def mark(self, section, server_name=None):
+        with self._lock:
+            self._dirty.add((section, server_name))
+            if self._source is not None:
+                GLib.source_remove(self._source)
+            self._source = GLib.timeout_add(self.delay, self._on_timeout)
+
+    def path(self, section, server_name=None):
+        if section == 'server':
+            return self.config.get_server_path(server_name + '.json')
+        return self.config.sections()[section][0]
+
+    def pending(self, path):
+        """Whether a change of ``path`` is marked or queued, not written."""
+        with self._lock:
+            if path in self._queued:
+                return True
+            dirty = list(self._dirty)
+        return any(self.path(*key) == path for key in dirty)
+
+    def written(self, path):
+        """The text this process last wrote to ``path``, if any."""
+        with self._lock:
+            return self._written.get(path)
+
+    def _on_timeout(self):
+        with self._lock:
+            self._source = None
+        self.executor.submit(self._write, self.collect())
+        return False
+
+    def _write(self, pending):
+        try:
+            return self.write(pending)
+        except Exception as e:
+            self.logger.exception(e)
+            return False
+
+    def collect(self):
+        """Serialize every dirty section, as ``(files, servers)``."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        config = self.config
+        files = {}
+        servers = {}
+        for section, server_name in dirty:
+            if section == 'server':
+                if server_name in config.servers:
+                    servers[server_name] = config.servers.raw(server_name)
+            else:
+                filename, item = config.sections()[section]
+                files[filename] = item.dumps()
+        with self._lock:
+            self._queued.update(files)
+            if not config.store:
+                self._queued.update(
+                    self.path('server', name) for name in servers
+                )
+        return files, servers
+
+    def write(self, pending):
+        files, servers = pending
+        for filename, content in files.items():
+            self._write_file(filename, content)
+        if servers and self.config.store:
+            self.config.store.update(save=servers)
+        elif servers:
+            for server_name, content in servers.items():
+                self._write_file(self.path('server', server_name), content)
+        if files or servers:
+            self.logger.debug(
+                'Flushed %s config files and %s servers',
+                len(files), len(servers)
+            )
+        return True
+
+    def _write_file(self, filename, content):
+        try:
+            GLib.file_set_contents(filename, content.encode('utf8'))
+            with self._lock:
+                self._written[filename] = content
+        finally:
+            with self._lock:
+                self._queued.discard(filename)
+
+    def flush(self):
+        """Write everything dirty now, after the writes still queued."""
+        with self._lock:
+            if self._source is not None:
+                GLib.source_remove(self._source)
+                self._source = None
+        return self.executor.submit(self.write, self.collect()).result()
+
+
 class Configure(ConfigItem):
     application_name = str(GLib.get_application_name())
     path = os.path.join(GLib.get_user_config_dir(), application_name)
-    servers = ConfigItem()
+    servers = LazyConfigItem()
     pac_file = os.path.join(path, 'pac.yml')
     app_file = os.path.join(path, application_name + '.yml')
     local_file = os.path.join(path, 'local.yml')
     servers_path = os.path.join(path, 'servers')
+    servers_db = os.path.join(path, 'servers.db')
     resources_path = os.path.join(os.path.dirname(__file__), 'resources')
+    snapshot_file = os.path.join(
+        GLib.get_user_cache_dir(), application_name, 'config-snapshot.json'
+    )
+    store = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        object.__setattr__(self, 'writer', WriteBehind(self))
+
+    def defer(self, section, server_name=None):
+        """Save ``section`` soon, together with other deferred saves."""
+        return self.writer.mark(section, server_name)
+
+    def flush(self):
+        return self.writer.flush()
+
+    def sections(self):
+        return {
+            'application': (self.app_file, self.application),
+            'local': (self.local_file, self.local),
+            'pac': (self.pac_file, self.pac),
+        }
 
     def get_server_path(self, server_name):
         return os.path.join(self.servers_path, server_name)
 
     def save_server(self, server_name):
+        if self.store:
+            return self.store.update(save={
+                server_name: self.servers.raw(server_name)
+            })
         filename = self.get_server_path(server_name + '.json')
         content = self.servers[server_name]
         return self._save(filename, content)
 
+    def rename_server(self, old_name, server_name):
+        if self.store:
+            return self.store.update(
+                save={server_name: self.servers.raw(server_name)},
+                delete=[old_name]
+            )
+        self.save_server(server_name)
+        filename = self.get_server_path(old_name + '.json')
+        return os.unlink(filename)
+
+    def save_servers(self, server_names):
+        """Write several servers at once.
+
+        Every file is written to a temporary name first and only renamed
+        into place once all of them were written, with a single sync of
+        the directory at the end.
+        """
+        if self.store:
+            return self.store.update(save={
+                server_name: self.servers.raw(server_name)
+                for server_name in server_names
+            })
+        pending = []
+        try:
+            for server_name in server_names:
+                filename = self.get_server_path(server_name + '.json')
+                fd, tmp = tempfile.mkstemp(
+                    prefix='.' + server_name + '.', dir=self.servers_path
+                )
+                pending.append((tmp, filename))
+                with open(fd, 'w', encoding='utf8') as server_file:
+                    server_file.write(self.servers.raw(server_name))
+        except BaseException:
+            for tmp, _ in pending:
+                os.unlink(tmp)
+            raise
+        for tmp, filename in pending:
+            os.replace(tmp, filename)
+        dir_fd = os.open(self.servers_path, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        return True
+
     def delete_server(self, server_name):
-        filename = self.get_server_path(server_name + '.json')
         self.servers.pop(server_name)
+        if self.store:
+            return self.store.update(delete=[server_name])
+        filename = self.get_server_path(server_name + '.json')
         return os.unlink(filename)
 
+    def delete_servers(self, server_names):
+        if self.store:
+            for server_name in server_names:
+                self.servers.pop(server_name, None)
+            return self.store.update(delete=server_names)
+        for server_name in server_names:
+            self.servers.pop(server_name, None)
+            try:
+                os.unlink(self.get_server_path(server_name + '.json'))
+            except FileNotFoundError:
+                pass
+        return True
+
     def save_pac(self):
         return self._save(self.pac_file, self.pac)
 
@@ -80,33 +378,105 @@ class Configure(ConfigItem):
 
     def load_configures(self):
         self.update(self.default())
+        if not os.path.isdir(self.path):
+            os.mkdir(self.path)
+        if not os.path.isdir(self.servers_path):
+            os.mkdir(self.servers_path)
+
+        sources = self._sources()
+        snapshot = self._load_snapshot(sources)
+        if snapshot is None:
+            snapshot = self._build_snapshot(sources)
+            self._save_snapshot(snapshot)
+
+        self.application.update(snapshot['application'])
+        self.local.update(snapshot['local'])
+        self.pac.update(snapshot['pac'])
+        if self.application.server_store == 'sqlite':
+            self.servers.load_raw(self._open_store(snapshot))
+        else:
+            self.servers.load_raw(snapshot['servers'])
         self._prepare()
-        for filename in os.listdir(self.servers_path):
-            if not filename.endswith('.json'):
+
+    def _open_store(self, snapshot):
+        from .serverstore import ServerStore
+        store = ServerStore(self.servers_db)
+        object.__setattr__(self, 'store', store)
+        if snapshot['servers'] and store.migrate(self.servers_path):
+            self._save_snapshot(self._build_snapshot(self._sources()))
+        return store.load()
+
+    def _sources(self):
+        """Modification times of every file the configure is loaded from."""
+        sources = {}
+        for filename in (self.app_file, self.local_file, self.pac_file):
+            try:
+                stat = os.stat(filename)
+            except FileNotFoundError:
+                continue
+            sources[filename] = [stat.st_mtime_ns, stat.st_size]
+        for entry in os.scandir(self.servers_path):
+            if not entry.name.endswith('.json'):
                 continue
-            name = filename.rsplit('.json', 1)[0]
-            self.servers[name] = self._load(self.get_server_path(filename))
+            stat = entry.stat()
+            sources[entry.path] = [stat.st_mtime_ns, stat.st_size]
+        return sources
+
+    def _load_snapshot(self, sources):
+        try:
+            with open(self.snapshot_file, encoding='utf8') as snapshot_file:
+                snapshot = json.load(snapshot_file)
+        except (OSError, ValueError):
+            return None
+        if snapshot.get('version') != SNAPSHOT_VERSION \
+                or snapshot.get('sources') != sources:
+            return None
+        return snapshot
+
+    def _build_snapshot(self, sources):
+        snapshot = dict(
+            version=SNAPSHOT_VERSION,
+            sources=sources,
+            application={},
+            local={},
+            pac={},
+            servers={}
+        )
+        for section, filename in (('application', self.app_file),
+                                  ('local', self.local_file),
+                                  ('pac', self.pac_file)):
+            if filename in sources:
+                snapshot[section] = self._load(filename)
+        for filename in sources:
+            if os.path.dirname(filename) != self.servers_path:
+                continue
+            name = os.path.basename(filename).rsplit('.json', 1)[0]
+            _, content = GLib.file_get_contents(filename)
+            snapshot['servers'][name] = content.decode('utf8')
+        return snapshot
+
+    def _save_snapshot(self, snapshot):
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_file), exist_ok=True)
+            GLib.file_set_contents(
+                self.snapshot_file,
+                json.dumps(snapshot, separators=(',', ':')).encode('utf8')
+            )
+        except (OSError, GLib.Error):
+            return False
+        return True
 
     def _load(self, filename):
         _, content = GLib.file_get_contents(filename)
         if filename.endswith('yml'):
-            return ConfigItem(yaml.load(content.decode('utf8')))
+            return ConfigItem(
+                yaml.load(content.decode('utf8'), Loader=YamlLoader) or {}
+            )
         elif filename.endswith('json'):
             return ConfigItem(json.loads(content.decode('utf8')))
         raise TypeError(filename + ' is not an json or yaml file!')
 
-
     def _prepare(self):
-        if not os.path.isdir(self.path):
-            os.mkdir(self.path)
-        if os.path.isfile(self.app_file):
-            self.application.update(self._load(self.app_file))
-        if os.path.isfile(self.local_file):
-            self.local.update(self._load(self.local_file))
-        if os.path.isfile(self.pac_file):
-            self.pac.update(self._load(self.pac_file))
-        if not os.path.isdir(self.servers_path):
-            os.mkdir(self.servers_path)
         if not os.path.isdir(os.path.dirname(self.pac.path)):
             os.mkdir(os.path.dirname(self.pac.path))
         if not os.path.isfile(self.pac.user_rules):
@@ -123,11 +493,24 @@ class Configure(ConfigItem):
             auto_connect='false',
             auto_reconnect='false',
             proxy_type=None,
+            server_store='files',
+            subscriptions=[],
+            subscription_interval=6 * 60 * 60,
+            probe_interval=10 * 60,
+            probe_workers=8,
+            instrument='false',
+            profile='false',
+            log_level='INFO',
+            log_levels={},
             icon=os.path.join(self.resources_path, 'ss24x24.png')
         )
         ss_local = ConfigItem(
             port=1080,
             address='127.0.0.1',
+            http_proxy=True,
+            http_port=1087,
+            http_timeout=300,
+            http_routing=False,
             verbose=3,
             one_time_auth=False,
             workers=1,
@@ -155,14 +538,30 @@ class Configure(ConfigItem):
         )
         pac_config = ConfigItem(
             compress=False,
+            gzip=False,
+            minified=False,
+            direct_networks='',
+            proxy_networks='',
+            resolve_networks=False,
+            bypass_private=True,
+            bypass_networks='',
+            bypass_limit=2000,
+            serve=True,
+            serve_address='127.0.0.1',
+            serve_port=1089,
+            serve_max_age=300,
             path=os.path.join(self.path, 'pac', self.application_name + '.pac'),
             gfwlist_modified='',
             gfwlist_url=GFWLIST,
+            update_interval=24 * 60 * 60,
+            update_jitter=0.1,
+            update_retry=5 * 60,
             user_rules=os.path.join(self.path, 'pac', 'user-rules.txt'),
             local_gfwlist=os.path.join(self.path, 'pac', 'gfwlist.txt')
         )
         logger = ConfigItem(
             version=1,
+            disable_existing_loggers=False,
             formatters=ConfigItem(
                 default=ConfigItem(
                     format=FORMAT
@@ -170,31 +569,24 @@ class Configure(ConfigItem):
             ),
             handlers=ConfigItem(
                 console=ConfigItem({
-                    'level': 'DEBUG',
                     'class': 'logging.StreamHandler',
                     "stream": "ext://sys.stdout",
                     'formatter': 'default',
                 }),
                 logfile=ConfigItem({
-                    'level': 'DEBUG',
-                    "class": "logging.FileHandler",
+                    "class": "logging.handlers.RotatingFileHandler",
                     'formatter': 'default',
                     'filename': os.path.join(
                         GLib.get_user_runtime_dir(),
                         self.application_name + '.log'
                     ),
+                    'maxBytes': 1024 * 1024,
+                    'backupCount': 3,
+                    'delay': True,
                     'encoding': 'utf8'
                 })
             ),
-            logger=ConfigItem({
-                self.application_name: ConfigItem(
-                    level="DEBUG",
-                    propagate=1,
-                    handlers=['console', 'logfile']
-                )
-            }),
             root=ConfigItem(
-                level="DEBUG",
                 handlers=['console', 'logfile']
             )
         )
@@ -0,0 +1,120 @@
+# coding: utf8
+
+import sys
+import signal
+import logging
+import argparse
+
+from gi.repository import GLib
+
+from .local import Local
+from .config import Config
+from .tasks import AsyncCall, Scheduler
+from .logger import setup as setup_logging
+from .service import Service
+from .pacserver import PacServer
+from .httpproxy import HTTPProxy
+from .instrument import process_uptime
+
+
+class Daemon(Service):
+    """Runs sslocal, the pac server and the http proxy without Gtk."""
+
+    def __init__(self, server=None, pac_server=True, http_proxy=True):
+        setup_logging(
+            Config.logger,
+            Config.application.log_level,
+            Config.application.log_levels
+        )
+        self.logger = logging.getLogger(__name__)
+
+        self.loop = GLib.MainLoop()
+        self.scheduler = Scheduler()
+        self.sslocal = Local()
+        if server:
+            self.sslocal.set_server(server)
+
+        self.pac_server = PacServer(Config) if pac_server else None
+        self.http_proxy = HTTPProxy(Config) if http_proxy else None
+
+    def start(self):
+        if self.pac_server:
+            self.pac_server.start()
+        if self.http_proxy:
+            self.http_proxy.start()
+            AsyncCall(self.load_router)
+        AsyncCall(self.sslocal.control, 'start')
+        self.schedule_common_jobs()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            GLib.unix_signal_add(GLib.PRIORITY_HIGH, signum, self.stop)
+        self.logger.info('Daemon started.')
+
+    def run(self, startup_time=False):
+        self.start()
+        if startup_time:
+            GLib.idle_add(self._on_started)
+        self.loop.run()
+
+    def _on_started(self):
+        # Tagged like the one of the application, for the benchmark.
+        print('startup-time: {:.3f}'.format(process_uptime()), flush=True)
+        return self.stop()
+
+    def stop(self):
+        self.logger.info('Daemon stopping..')
+        self.scheduler.stop()
+        if self.pac_server:
+            self.pac_server.stop()
+        if self.http_proxy:
+            self.http_proxy.stop()
+        self.sslocal.control('stop')
+        Config.flush()
+        self.loop.quit()
+        return False
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='shadowsocks-pygi-daemon',
+        description='Run shadowsocks-pygi without a graphical interface.'
+    )
+    parser.add_argument('-s', '--server', help='server to connect to')
+    parser.add_argument('-l', '--list', action='store_true',
+                        help='list configured servers and exit')
+    parser.add_argument('--update-pac', action='store_true',
+                        help='update the pac file once and exit')
+    parser.add_argument('--no-pac-server', action='store_true',
+                        help='do not serve the pac file over http')
+    parser.add_argument('--no-http-proxy', action='store_true',
+                        help='do not start the http proxy')
+    parser.add_argument('--startup-time', action='store_true',
+                        help='print the time until the main loop runs, '
+                        'then quit')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.list:
+        for name in sorted(Config.servers):
+            print(name)
+        return 0
+    if args.server and args.server not in Config.servers:
+        print('Unknown server: {}'.format(args.server), file=sys.stderr)
+        return 2
+
+    daemon = Daemon(
+        server=args.server,
+        pac_server=Config.pac.serve and not args.no_pac_server,
+        http_proxy=Config.local.http_proxy and not args.no_http_proxy
+    )
+    if args.update_pac:
+        daemon.update_pac()
+        Config.flush()
+        return 0
+    daemon.run(startup_time=args.startup_time)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
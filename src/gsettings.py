@@ -17,16 +17,75 @@
 
 import logging
 
+from contextlib import contextmanager
+
 from gi.repository import Gio, GLib  # noqa
 
 
 class SystemProxy:
+    """Applies proxy profiles to the desktop proxy settings.
+
+    Each profile is written between ``delay()`` and ``apply()``, so all of
+    its keys reach listening applications as one change, and keys which
+    already hold the wanted value are not written at all.
+    """
     schema = 'org.gnome.system.proxy'
+    children = ('http', 'https', 'socks')
     ignore_hosts = ['localhost', '127.0.0.0/8', '::1']
 
-    def __init__(self):
-        self.gsetting = Gio.Settings(schema=self.schema)
+    _instance = None
+
+    def __init__(self, backend=None):
+        if backend is None:
+            self.gsetting = Gio.Settings(schema=self.schema)
+        else:
+            self.gsetting = Gio.Settings.new_with_backend(self.schema, backend)
+        self._children = {
+            child: self.gsetting.get_child(child) for child in self.children
+        }
         self.logger = logging.getLogger(__name__)
+        self._depth = 0
+
+    @classmethod
+    def get(cls):
+        """The shared instance, bound to the default settings backend."""
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    @classmethod
+    def memory(cls):
+        """An instance on a memory backend, which never touches the desktop.
+        """
+        return cls(Gio.memory_settings_backend_new())
+
+    @contextmanager
+    def batch(self):
+        settings = [self.gsetting] + list(self._children.values())
+        if not self._depth:
+            for item in settings:
+                item.delay()
+        self._depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._depth -= 1
+            if not self._depth:
+                for item in settings:
+                    item.revert()
+            raise
+        self._depth -= 1
+        if self._depth:
+            return
+        for item in settings:
+            if item.get_has_unapplied():
+                item.apply()
+
+    def _set(self, settings, key, value):
+        if settings.get_value(key) == value:
+            return False
+        settings.set_value(key, value)
+        return True
 
     def set_ignore_hosts(self, *hosts):
         host = []
@@ -35,48 +94,75 @@ class SystemProxy:
                 host.extend(_item)
             else:
                 host.append(_item)
-        self.logger.info('Set hosts<{}> to be ignored'.format(hosts))
-        self.ignore_hosts = hosts
+        self.logger.info('Set hosts<%s> to be ignored', host)
+        self.ignore_hosts = host
 
     def apply_ignore_hosts(self):
-        self.gsetting.set_value(
-            'ignore-hosts',
-            GLib.Variant('as', self.ignore_hosts)
-        )
-        self.logger.info('Apply ignored hosts<{}>'.format(self.ignore_hosts))
+        with self.batch():
+            self._set(
+                self.gsetting,
+                'ignore-hosts',
+                GLib.Variant('as', self.ignore_hosts)
+            )
+        self.logger.info('Apply ignored hosts<%s>', self.ignore_hosts)
 
     def get_ignore_hosts(self):
-        ignore_hosts = tuple(self.gsetting.get_value('ignore-hosts'))
-        if ignore_hosts != self.ignore_hosts:
-            self.ignore_hosts = ignore_hosts
-        self.logger.debug('Get ignored hosts<{}>'.format(self.ignore_hosts))
+        self.ignore_hosts = list(self.gsetting.get_value('ignore-hosts'))
+        self.logger.debug('Get ignored hosts<%s>', self.ignore_hosts)
         return self.ignore_hosts
 
-    def global_proxy(self, proxy_type='socks5'):
-        self.logger.debug('Set proxy type: global.')
+    def global_proxy(self, socks, http=None):
+        with self.batch():
+            self._set_mode('manual')
+            self._set(self.gsetting, 'use-same-proxy',
+                      GLib.Variant('b', False))
+            self._set_child('socks', *socks)
+            if http:
+                self._set_child('http', *http)
+                self._set_child('https', *http)
+            self.apply_ignore_hosts()
+        self.logger.debug(
+            'Set proxy type: global, socks: %s, http: %s', socks, http
+        )
+        return True
 
     def none_proxy(self):
-        self.gsetting.set_value('mode', GLib.Variant('s', 'none'))
+        with self.batch():
+            self._set_mode('none')
         self.logger.debug('Set proxy type: None.')
         return True
 
     def by_pac(self, pac):
-        self.gsetting.set_value('use-same-proxy', GLib.Variant('b', True))
-        self.gsetting.set_value('mode', GLib.Variant('s', 'auto'))
-        self.gsetting.set_value('autoconfig-url', GLib.Variant('s', pac))
-        self.logger.debug('Set auto proxy type, with pac: {}'.format(pac))
+        with self.batch():
+            self._set(self.gsetting, 'use-same-proxy', GLib.Variant('b', True))
+            self._set_mode('auto')
+            self._set(self.gsetting, 'autoconfig-url', GLib.Variant('s', pac))
+        self.logger.debug('Set auto proxy type, with pac: %s', pac)
         return True
 
+    def _set_mode(self, mode):
+        return self._set(self.gsetting, 'mode', GLib.Variant('s', mode))
+
+    def _set_child(self, child, host, port):
+        settings = self._children[child]
+        self._set(settings, 'host', GLib.Variant('s', host))
+        self._set(settings, 'port', GLib.Variant('i', int(port)))
+
     def by_socks(self, host, port):
-        self.gsetting.set_value('mode', GLib.Variant('s', 'manual'))
-        socks = self.gsetting.get_child('socks')
-        socks.set_value('host', GLib.Variant('s', host))
-        socks.set_value('port', GLib.Variant('i', port))
-        self.apply_ignore_hosts()
-        return True
+        return self._by_child('socks', host, port)
 
     def by_http(self, host, port):
-        pass
+        return self._by_child('http', host, port)
 
     def by_https(self, host, port):
-        pass
+        return self._by_child('https', host, port)
+
+    def _by_child(self, child, host, port):
+        with self.batch():
+            self._set_mode('manual')
+            self._set_child(child, host, port)
+            self.apply_ignore_hosts()
+        self.logger.debug(
+            'Set proxy type: %s, %s:%s', child, host, port
+        )
+        return True
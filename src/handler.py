@@ -2,7 +2,6 @@
 
 import logging
 
-from .pac import Pac
 from .tasks import AsyncCall
 from .config import Config, ConfigItem
 from gi.repository import Gtk
@@ -20,7 +19,7 @@ class Handler:
 
     def on_cancel_btn_clicked(self, dialog):
         self.logger.debug('Cancel button clicked.')
-        self.logger.debug('Hide dialog<{}>.'.format(dialog.get_title()))
+        self.logger.debug('Hide dialog<%s>.', dialog.get_title())
         return dialog.hide()
 
     def on_server_save_btn_clicked(self, dialog):
@@ -57,34 +56,27 @@ class Handler:
         )
 
         title = dialog.get_title()
-        Config.save_server(name)
+        if title not in (name, 'Add Server...'):
+            Config.servers.pop(title, None)
+            Config.rename_server(title, name)
+        else:
+            Config.save_server(name)
         if title != name:
-            server_list = self.app.builder.get_object('ServerListView')
+            servers = self.app.server_list
             if title == 'Add Server...':
-                tree_iter = server_list.get_model().append([name])
+                servers.append(name, Config.servers[name])
                 self.logger.debug(
-                    'Append to new server <{}> to server_list'.format(name)
+                    'Append to new server <%s> to server_list', name
                 )
-                server_list.get_selection().select_iter(tree_iter)
             else:
-                Config.delete_server(title)
-                self.logger.debug(
-                    'Delete old server <{}> from config'.format(title)
-                )
-                selection = server_list.get_selection()
-                model, tree_iter = selection.get_selected()
-                edited_iter = model.insert_after(
-                    model[tree_iter].get_previous(),
-                    [name]
-                )
+                servers.rename(title, name)
                 self.logger.debug(
-                    'Append to new server <{}> to server_list'.format(name)
-                )
-                selection.select_iter(edited_iter)
-                model.remove(tree_iter)
-                self.logger.debug(
-                    'Delete old server <{}> from server_list'.format(title)
+                    'Rename server <%s> to <%s> in server_list', title, name
                 )
+            tree_iter = servers.view_iter(name)
+            if tree_iter is not None:
+                self.app.builder.get_object('ServerSelection') \
+                    .select_iter(tree_iter)
 
         return dialog.hide()
 
@@ -106,18 +98,25 @@ class Handler:
         Config.delete_server(server_name)
         prev = model[tree_iter].get_previous()
         next = model[tree_iter].get_next()
-        model.remove(tree_iter)
-        if next:
-            return selection.select_iter(next.iter)
-        elif prev:
-            return selection.select_iter(prev.iter)
+        neighbour = next or prev
+        neighbour = neighbour[0] if neighbour else None
+        servers = self.app.server_list
+        servers.remove(server_name)
+        if neighbour is not None:
+            tree_iter = servers.view_iter(neighbour)
+            if tree_iter is not None:
+                return selection.select_iter(tree_iter)
+        return True
+
+    def on_server_search_changed(self, entry):
+        self.app.server_list.set_query(entry.get_text())
         return True
 
     def on_advance_btn_clicked(self, selection):
         self.logger.debug('Advance button clicked.')
         server_list, tree_iter = selection.get_selected()
         server_name = server_list[tree_iter][0]
-        self.logger.debug('Selected server is: {}.'.format(server_name))
+        self.logger.debug('Selected server is: %s.', server_name)
 
         builder = self.app.builder
         config = Config.servers[server_name]
@@ -141,51 +140,52 @@ class Handler:
         setting_dialog.show()
         setting_dialog.run()
         setting_dialog.hide()
-        self.logger.debug('Hide dialog<{}>.'.format(server_name))
+        self.logger.debug('Hide dialog<%s>.', server_name)
         return True
 
     def on_connection_switch_changed(self, switch, state):
         self.logger.debug(
-            'Connection_Switch button clicked. state to be {}'.format(state)
+            'Connection_Switch button clicked. state to be %s', state
         )
+        sslocal = self.app.sslocal
         if state:
-            if self.app.sslocal.is_running:
+            if sslocal.is_running or sslocal.pending == 'start':
                 self.logger.debug('sslocal is already running!')
             else:
                 AsyncCall(
-                    self.app.sslocal.control,
+                    sslocal.control,
                     'start',
                     callback=lambda r, e: switch.set_state(False) if e else None
                 )
             switch.set_state(True)
         else:
-            if not self.app.sslocal.is_running:
+            if sslocal.pending == 'stop' or not (
+                    sslocal.is_running or sslocal.pending == 'start'):
                 self.logger.debug('sslocal is already stopped!')
             else:
                 AsyncCall(
-                    self.app.sslocal.control,
+                    sslocal.control,
                     'stop',
                     callback=lambda r, e: switch.set_state(True) if e else None
                 )
             switch.set_state(False)
         self.logger.debug(
-            'Successed to change Connection_Switch\'s state to {}'.format(state)
+            'Successed to change Connection_Switch\'s state to %s', state
         )
         return True
 
     def on_server_switch_changed(self, selection, state):
         self.logger.debug(
-            'Server_Switch button clicked, State must to be {}'.format(state)
+            'Server_Switch button clicked, State must to be %s', state
         )
         server_list, tree_iter = selection.get_selected()
         server_name = server_list[tree_iter][0]
-        self.logger.debug('Selected server is: {}'.format(server_name))
+        self.logger.debug('Selected server is: %s', server_name)
         Config.servers[server_name].enabled = state
-        Config.save_server(server_name)
+        Config.defer('server', server_name)
+        self.app.server_list.update(server_name, enabled=state)
         self.logger.debug(
-            'Successed to change state<{}> of server<{}>'.format(
-                server_name, state
-            )
+            'Successed to change state<%s> of server<%s>', server_name, state
         )
         self.app.builder.get_object('ServerControl').set_state(state)
         return True
@@ -197,7 +197,7 @@ class Handler:
             server_name = ''
             return True
         server_name = server_list[tree_iter][0]
-        self.logger.debug('Server<{}> is selected.'.format(server_name))
+        self.logger.debug('Server<%s> is selected.', server_name)
         server = Config.servers.get(server_name)
         builder.get_object('ServerNameLabel').set_label(server_name)
         builder.get_object('ConnectStateLabel').set_label('Not')
@@ -208,71 +208,46 @@ class Handler:
 
     def on_gfwlist_update_clicked(self, *args):
         self.logger.debug('Gfwlist_Update is clicked.')
-        pac = Pac(Config)
-        if Config.application.connected:
-            proxy = 'socks5://{}:{}'.format(
-                Config.local.address,
-                Config.local.port
-            )
-            pac.set_proxy(http=proxy, https=proxy)
-        pac.fetch_remote_gfwlist()
-        if pac.gfwlist_modified == '':
-            self.logger.error(
-                'Failed to update gfwlist: {}'.format(Config.pac.gfwlist_url)
-            )
-            raise Exception()  # TODO: add notify -- Update failed
-        if Config.pac.gfwlist_modified == pac.gfwlist_modified:
-            self.logger.error('Gfwlist is already up to date.')
-            raise Exception()  # TODO: add notify -- Almost new
-        pac.fetch_user_rules()
-        self.logger.debug('Fetch user roles.')
-        pac.save(pac.generate())
-        self.logger.info('Success to generate pac file.')
+        self.app.scheduler.run_now('gfwlist')
         return True
 
     def on_user_rules_saved(self, *args):
         self.logger.debug('User rules is changed.')
-        # TODO: monitor for user_rules
-        pac = Pac(Config)
-        pac.fetch_user_rules()
-        pac.save(pac.generate())
-        self.logger.info('Success to generate pac file.')
+        self.app.rebuild_pac()
         return True
 
     def on_menu_btn_clicked(self, *args):
         self.logger.debug('Menu btn clicked.')
         menu = self.app.builder.get_object('MenuPop')
+        if args and args[0].get_popover() is None:
+            args[0].set_popover(menu)
         menu.show_all()
         print(args)
 
     def on_server_dialog_close(self, dialog):
         self.logger.debug(
-            'Close button of dialog<{}> is clicked'.format(dialog.get_title())
+            'Close button of dialog<%s> is clicked', dialog.get_title()
         )
         return True
 
     def on_server_dialog_response(self, dialog, response):
         if response == Gtk.ResponseType.DELETE_EVENT:
             self.logger.debug(
-                'Dialog<{}> receive DELETE_EVENT response.'.format(
-                    dialog.get_title()
-                )
+                'Dialog<%s> receive DELETE_EVENT response.', dialog.get_title()
             )
             return True
         self.logger.debug(
-            'Dialog<{}> receive response signal: {}'.format(
-                dialog.get_title(), response
-            )
+            'Dialog<%s> receive response signal: %s',
+            dialog.get_title(),
+            response
         )
         dialog.hide()
         self.do_clean_on_dialog_hide(dialog)
-        self.logger.debug('Dialog<{}> is hidden.'.format(dialog.get_title()))
+        self.logger.debug('Dialog<%s> is hidden.', dialog.get_title())
         return True
 
     def do_clean_on_dialog_hide(self, dialog):
-        self.logger.debug(
-            'Dialog<{}> receive hide signal'.format(dialog.get_title())
-        )
+        self.logger.debug('Dialog<%s> receive hide signal', dialog.get_title())
         builder = self.app.builder
         builder.get_object('NameEntry').set_text('')
         builder.get_object('NameEntry').set_text('')
@@ -288,6 +263,6 @@ class Handler:
         self.app.builder.get_object('PasswordEntry') \
             .set_visibility(check_button.get_active())
         self.logger.debug(
-            'Is show password set to: {}'.format(check_button.get_active())
+            'Is show password set to: %s', check_button.get_active()
         )
         return True
@@ -0,0 +1,440 @@
+# coding: utf8
+
+import socket
+import select
+import struct
+import logging
+import threading
+import http.client
+
+from urllib.parse import urlsplit
+from socketserver import ThreadingMixIn, TCPServer, StreamRequestHandler
+
+from .resolver import resolver
+
+HOP_BY_HOP = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'proxy-connection', 'te', 'trailer', 'transfer-encoding', 'upgrade',
+}
+
+
+class SocksError(OSError):
+    pass
+
+
+def encode_host(host):
+    """``host`` as sent in a socks5 request; ValueError when it cannot be.
+    """
+    try:
+        name = host.encode('idna')
+    except UnicodeError as e:
+        raise ValueError('Bad host name {!r}: {}'.format(host[:64], e))
+    if not name or len(name) > 255:
+        raise ValueError('Bad host name length: {}'.format(len(name)))
+    return name
+
+
+def socks5_connect(proxy, host, port, timeout=None):
+    """Open a tcp connection to ``host:port`` through the socks5 ``proxy``.
+    """
+    name = encode_host(host)
+    sock = socket.create_connection(proxy, timeout)
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.sendall(b'\x05\x01\x00')
+        if _recv_exactly(sock, 2) != b'\x05\x00':
+            raise SocksError('socks5 proxy refused the handshake')
+        sock.sendall(
+            b'\x05\x01\x00\x03' + bytes([len(name)]) + name +
+            struct.pack('!H', port)
+        )
+        version, reply, _, atyp = _recv_exactly(sock, 4)
+        if version != 5 or reply != 0:
+            raise SocksError(
+                'socks5 connect to {}:{} failed: {}'.format(host, port, reply)
+            )
+        if atyp == 1:
+            _recv_exactly(sock, 4 + 2)
+        elif atyp == 4:
+            _recv_exactly(sock, 16 + 2)
+        else:
+            _recv_exactly(sock, _recv_exactly(sock, 1)[0] + 2)
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+def _recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise SocksError('socks5 proxy closed the connection')
+        data += chunk
+    return data
+
+
+class SocksHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, host, port, proxy, timeout=None):
+        super().__init__(host, port, timeout=timeout)
+        self.proxy = proxy
+
+    def connect(self):
+        if self.proxy is None:
+            self.sock = resolver.create_connection(
+                (self.host, self.port), self.timeout
+            )
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return
+        self.sock = socks5_connect(self.proxy, self.host, self.port,
+                                   self.timeout)
+
+
+class ConnectionPool:
+    """Idle upstream connections, by origin and route."""
+
+    def __init__(self, proxy, timeout=60, max_idle=8):
+        self.proxy = proxy
+        self.timeout = timeout
+        self.max_idle = max_idle
+
+        self._lock = threading.Lock()
+        self._idle = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, host, port, direct=False):
+        with self._lock:
+            idle = self._idle.get((host, port, direct))
+            if idle:
+                self.hits += 1
+                return idle.pop()
+            self.misses += 1
+        proxy = None if direct else self.proxy
+        return SocksHTTPConnection(host, port, proxy, self.timeout)
+
+    def put(self, conn):
+        if conn.sock is None:
+            return
+        key = (conn.host, conn.port, conn.proxy is None)
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+class _ProxyRequestHandler(StreamRequestHandler):
+    wbufsize = 65536
+
+    def setup(self):
+        super().setup()
+        self.connection.settimeout(self.server.idle_timeout)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        keep_alive = True
+        while keep_alive:
+            try:
+                keep_alive = self.handle_one_request()
+            except (OSError, ValueError, http.client.HTTPException) as e:
+                self.server.logger.debug('Proxy request failed: %s', e)
+                return
+
+    def handle_one_request(self):
+        line = self.rfile.readline(65537)
+        if not line:
+            return False
+        try:
+            method, target, version = line.decode('latin1').split()
+        except ValueError:
+            self._error(400, 'Bad Request')
+            return False
+        headers = http.client.parse_headers(self.rfile)
+
+        if method == 'CONNECT':
+            return self.do_connect(target)
+        return self.do_forward(method, target, version, headers)
+
+    def is_direct(self, host):
+        router = self.server.router
+        return router is not None and router.is_direct(host)
+
+    @staticmethod
+    def _address(host, port):
+        """Checked ``(host, port)`` of a request, ValueError when invalid."""
+        port = int(port)
+        if not 0 < port < 65536:
+            raise ValueError('Bad port: {}'.format(port))
+        encode_host(host)
+        return host, port
+
+    def do_connect(self, target):
+        host, _, port = target.rpartition(':')
+        try:
+            host, port = self._address(host.strip('[]'), port)
+        except ValueError:
+            self._error(400, 'Bad Request')
+            return False
+        try:
+            if self.is_direct(host):
+                upstream = resolver.create_connection(
+                    (host, port), self.server.idle_timeout
+                )
+            else:
+                upstream = socks5_connect(
+                    self.server.socks, host, port, self.server.idle_timeout
+                )
+        except (OSError, ValueError) as e:
+            self.server.logger.info('CONNECT %s failed: %s', target, e)
+            self._error(502, 'Bad Gateway')
+            return False
+        self.wfile.write(b'HTTP/1.1 200 Connection Established\r\n\r\n')
+        self.wfile.flush()
+        with upstream:
+            self._relay(upstream)
+        return False
+
+    def _relay(self, upstream):
+        client = self.connection
+        # Hand over whatever the client sent along with the CONNECT request
+        # and is already buffered, without blocking for more.
+        client.setblocking(False)
+        try:
+            pending = self.rfile.peek()
+        finally:
+            client.setblocking(True)
+        if pending:
+            upstream.sendall(self.rfile.read(len(pending)))
+        client.settimeout(None)
+        upstream.settimeout(None)
+        sockets = [client, upstream]
+        while True:
+            readable, _, errored = select.select(
+                sockets, [], sockets, self.server.idle_timeout
+            )
+            if errored or not readable:
+                return
+            for sock in readable:
+                data = sock.recv(65536)
+                if not data:
+                    return
+                (upstream if sock is client else client).sendall(data)
+
+    def do_forward(self, method, target, version, headers):
+        url = urlsplit(target)
+        length = headers.get('Content-Length')
+        try:
+            if url.scheme != 'http' or not url.hostname:
+                raise ValueError('Not an absolute http url')
+            host, port = self._address(url.hostname, url.port or 80)
+            if length is not None:
+                length = int(length)
+                if length < 0:
+                    raise ValueError('Negative Content-Length')
+        except ValueError:
+            self._error(400, 'Bad Request')
+            return False
+        path = url.path or '/'
+        if url.query:
+            path += '?' + url.query
+
+        body = None
+        if length is not None:
+            body = self.rfile.read(length)
+        elif 'chunked' in headers.get('Transfer-Encoding', '').lower():
+            try:
+                body = self._read_chunked()
+            except ValueError:
+                self._error(400, 'Bad Request')
+                return False
+
+        client_close = self._wants_close(version, headers)
+        hop = HOP_BY_HOP | self._connection_tokens(headers)
+
+        if 'Host' not in headers:
+            headers['Host'] = url.netloc
+
+        try:
+            conn, response = self._request(
+                host, port, method, path, headers, hop, body, length is None
+            )
+        except (OSError, ValueError, http.client.HTTPException) as e:
+            # ValueError covers UnicodeError, e.g. of header values.
+            self.server.logger.info('%s %s failed: %s', method, target, e)
+            self._error(502, 'Bad Gateway')
+            return False
+
+        chunked = response.chunked and response.length != 0
+        close = client_close or (
+            response.length is None and not chunked
+        )
+        self.wfile.write('HTTP/1.1 {} {}\r\n'.format(
+            response.status, response.reason
+        ).encode('latin1'))
+        hop = HOP_BY_HOP | self._connection_tokens(response.headers)
+        for name, value in response.getheaders():
+            if name.lower() not in hop:
+                self.wfile.write('{}: {}\r\n'.format(name, value)
+                                 .encode('latin1'))
+        if chunked:
+            self.wfile.write(b'Transfer-Encoding: chunked\r\n')
+        self.wfile.write(
+            b'Connection: close\r\n\r\n' if close
+            else b'Connection: keep-alive\r\n\r\n'
+        )
+
+        while True:
+            data = response.read(65536)
+            if not data:
+                break
+            if chunked:
+                self.wfile.write(
+                    '{:x}\r\n'.format(len(data)).encode('ascii') +
+                    data + b'\r\n'
+                )
+            else:
+                self.wfile.write(data)
+        if chunked:
+            self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+        if response.will_close:
+            conn.close()
+        else:
+            self.server.pool.put(conn)
+        return not close
+
+    def _request(self, host, port, method, path, headers, hop, body,
+                 set_length):
+        direct = self.is_direct(host)
+        while True:
+            conn = self.server.pool.get(host, port, direct)
+            reused = conn.sock is not None
+            try:
+                conn.putrequest(method, path, skip_host=True,
+                                skip_accept_encoding=True)
+                for name, value in headers.items():
+                    if name.lower() not in hop:
+                        conn.putheader(name, value)
+                if body is not None and set_length:
+                    conn.putheader('Content-Length', str(len(body)))
+                conn.endheaders(body)
+                return conn, conn.getresponse()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                # An idle pooled connection may have been closed by the
+                # server meanwhile, try again on a fresh one.
+                if not reused:
+                    raise
+
+    def _read_chunked(self):
+        body = b''
+        while True:
+            size = int(self.rfile.readline().split(b';')[0], 16)
+            if not size:
+                break
+            body += self.rfile.read(size)
+            self.rfile.readline()
+        while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+            pass
+        return body
+
+    @staticmethod
+    def _connection_tokens(headers):
+        tokens = set()
+        for value in headers.get_all('Connection') or []:
+            tokens.update(t.strip().lower() for t in value.split(','))
+        return tokens
+
+    def _wants_close(self, version, headers):
+        tokens = self._connection_tokens(headers)
+        for value in headers.get_all('Proxy-Connection') or []:
+            tokens.update(t.strip().lower() for t in value.split(','))
+        if 'close' in tokens:
+            return True
+        return version == 'HTTP/1.0' and 'keep-alive' not in tokens
+
+    def _error(self, code, reason):
+        self.wfile.write(
+            'HTTP/1.1 {} {}\r\nContent-Length: 0\r\n'
+            'Connection: close\r\n\r\n'.format(code, reason).encode('latin1')
+        )
+        self.wfile.flush()
+
+
+class _ProxyServer(ThreadingMixIn, TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class HTTPProxy:
+    """An http and https (CONNECT) proxy in front of the local socks port.
+
+    With a router set, hosts it decides to be direct are connected to
+    without going through the socks port.
+    """
+
+    def __init__(self, config):
+        self.logger = logging.getLogger(__name__)
+        self.config = config
+        self.router = None
+        self._server = None
+        self._thread = None
+
+    def set_router(self, router):
+        self.router = router
+        if self._server:
+            self._server.router = router
+
+    @property
+    def address(self):
+        return self._server.server_address[:2]
+
+    @property
+    def serving(self):
+        return self._server is not None
+
+    def start(self):
+        if self._server:
+            return True
+        local = self.config.local
+        self._server = _ProxyServer(
+            (local.address, int(local.http_port)),
+            _ProxyRequestHandler
+        )
+        self._server.logger = self.logger
+        self._server.router = self.router
+        self._server.idle_timeout = int(local.get('http_timeout', 300))
+        self._server.socks = (local.address, int(local.port))
+        self._server.pool = ConnectionPool(
+            self._server.socks, timeout=self._server.idle_timeout
+        )
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        self.logger.info('Http proxy is listening on %s:%s', *self.address)
+        return True
+
+    def stop(self):
+        if not self._server:
+            return True
+        self._server.shutdown()
+        self._server.server_close()
+        self._server.pool.clear()
+        self._server = None
+        self._thread = None
+        self.logger.info('Http proxy is stopped.')
+        return True
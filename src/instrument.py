@@ -0,0 +1,233 @@
+# coding: utf8
+"""Opt-in timing, counters and profiling.
+
+Everything is off by default and then costs one attribute lookup per
+call. ``enable()`` starts collecting timings and counters, from every
+thread. ``enable(profile=True)``, or ``start_profile()`` later, also runs
+``cProfile`` and ``tracemalloc``; that costs much more, so it inflates
+the timings, and cProfile only sees the thread it was started in, the
+main loop, not the ``AsyncCall`` workers. ``dump(directory)`` writes
+what was collected::
+
+    @timed('pac.generate')
+    def generate(self):
+        ...
+
+    with measure('pac.fetch'):
+        ...
+
+    count('local.start')
+"""
+
+import os
+import io
+import json
+import time
+import pstats
+import logging
+import functools
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Stats:
+    def __init__(self):
+        self.enabled = False
+        self.profiling = False
+        self._lock = threading.Lock()
+        self._timings = {}
+        self._counters = {}
+        self._gauges = {}
+        self._profile = None
+        self._started = None
+
+    def add(self, name, elapsed):
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                self._timings[name] = [1, elapsed, elapsed, elapsed]
+            else:
+                timing[0] += 1
+                timing[1] += elapsed
+                timing[2] = min(timing[2], elapsed)
+                timing[3] = max(timing[3], elapsed)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def register(self, name, func):
+        """Report the dict returned by ``func()`` under ``name``."""
+        self._gauges[name] = func
+
+    def enable(self, profile=False):
+        self.enabled = True
+        self._started = self._started or time.monotonic()
+        logger.info('Instrumentation enabled')
+        if profile:
+            self.start_profile()
+
+    def disable(self):
+        self.enabled = False
+        self.stop_profile()
+        logger.info('Instrumentation disabled')
+
+    def start_profile(self):
+        """Profile the calling thread, and trace memory allocations."""
+        if self.profiling:
+            return
+        import cProfile
+        import tracemalloc
+        tracemalloc.start()
+        if self._profile is None:
+            self._profile = cProfile.Profile()
+        self._profile.enable()
+        self.profiling = True
+        logger.info('Profiling enabled')
+
+    def stop_profile(self):
+        if not self.profiling:
+            return
+        import tracemalloc
+        self._profile.disable()
+        tracemalloc.stop()
+        self.profiling = False
+        logger.info('Profiling disabled')
+
+    def reset(self):
+        with self._lock:
+            self._timings = {}
+            self._counters = {}
+            self._started = time.monotonic() if self.enabled else None
+        if self._profile is not None:
+            self._profile.clear()
+
+    def snapshot(self):
+        """Timings in ms and counters, as a json-able dict."""
+        with self._lock:
+            timings = {
+                name: dict(
+                    count=n,
+                    total=round(total * 1000, 3),
+                    mean=round(total / n * 1000, 3),
+                    min=round(low * 1000, 3),
+                    max=round(high * 1000, 3),
+                ) for name, (n, total, low, high) in self._timings.items()
+            }
+            counters = dict(self._counters)
+        return dict(
+            uptime=round(time.monotonic() - self._started, 3)
+            if self._started else 0,
+            timings=timings,
+            counters=counters,
+            gauges={name: func() for name, func in self._gauges.items()},
+        )
+
+    def memory(self, limit=20):
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            return []
+        top = tracemalloc.take_snapshot().statistics('lineno')[:limit]
+        return [
+            dict(where=str(stat.traceback), size=stat.size, count=stat.count)
+            for stat in top
+        ]
+
+    def report(self, limit=30):
+        """A human readable summary, e.g. for a log or a dialog."""
+        snapshot = self.snapshot()
+        lines = ['{:<32} {:>7} {:>10} {:>10} {:>10}'.format(
+            'timing', 'count', 'total ms', 'mean ms', 'max ms'
+        )]
+        for name, t in sorted(snapshot['timings'].items(),
+                              key=lambda item: -item[1]['total']):
+            lines.append('{:<32} {:>7} {:>10.1f} {:>10.2f} {:>10.2f}'.format(
+                name, t['count'], t['total'], t['mean'], t['max']
+            ))
+        for name, n in sorted(snapshot['counters'].items()):
+            lines.append('{:<32} {:>7}'.format(name, n))
+        for name, gauges in sorted(snapshot['gauges'].items()):
+            for key, value in sorted(gauges.items()):
+                if isinstance(value, float):
+                    value = '{:.3f}'.format(value)
+                lines.append('{:<32} {:>7}'.format(name + '.' + key, value))
+        if self.profiling:
+            stream = io.StringIO()
+            pstats.Stats(self._profile, stream=stream) \
+                .sort_stats('cumulative').print_stats(limit)
+            lines.append(stream.getvalue())
+        return '\n'.join(lines)
+
+    def dump(self, directory, prefix='instrument'):
+        """Write ``<prefix>.json``, and ``<prefix>.prof`` when profiling.
+
+        The pstats file is readable with ``python -m pstats``.
+        """
+        path = os.path.join(directory, prefix + '.json')
+        snapshot = self.snapshot()
+        snapshot['memory'] = self.memory()
+        with open(path, 'w', encoding='utf8') as dump_file:
+            json.dump(snapshot, dump_file, indent=2, sort_keys=True)
+        paths = [path]
+        if self.profiling:
+            self._profile.dump_stats(os.path.join(directory, prefix + '.prof'))
+            paths.append(os.path.join(directory, prefix + '.prof'))
+        logger.info('Instrumentation dumped to %s', ', '.join(paths))
+        return paths
+
+
+stats = Stats()
+
+
+class measure:
+    """Time the ``with`` block under ``name`` when enabled."""
+
+    __slots__ = ('name', '_start')
+
+    def __init__(self, name):
+        self.name = name
+        self._start = None
+
+    def __enter__(self):
+        if stats.enabled:
+            self._start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        if self._start is not None:
+            stats.add(self.name, time.monotonic() - self._start)
+        return False
+
+
+def timed(name=None):
+    """Decorator timing every call under ``name``, the qualname by default.
+    """
+    def decorator(func):
+        label = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not stats.enabled:
+                return func(*args, **kwargs)
+            start = time.monotonic()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stats.add(label, time.monotonic() - start)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    if stats.enabled:
+        stats.count(name, n)
+
+
+def process_uptime():
+    """Seconds since this process was started, from ``/proc``."""
+    with open('/proc/self/stat') as stat:
+        started = int(stat.read().rsplit(')', 1)[1].split()[19])
+    with open('/proc/uptime') as uptime:
+        boot = float(uptime.read().split()[0])
+    return boot - started / os.sysconf('SC_CLK_TCK')
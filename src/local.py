@@ -2,13 +2,16 @@
 
 from .ping import Ping
 from .config import Config
+from .instrument import timed, count
 
 from shadowsocks import shell
 from shadowsocks.local import main
 
 import os
-import socket
 import logging
+import threading
+
+from gi.repository import Gio, GLib
 
 
 class Local:
@@ -19,33 +22,64 @@ class Local:
         self._server = None
         self._config = Config.local
 
+        self._alive = False
+        self._probing = []
+        self._probe_in_flight = False
+        self._watchers = []
+        self._pending = None
+        self._pending_lock = threading.Lock()
+        self.probe()
+
     def set_server(self, server):
         self._server = server
         self._config.update(Config.servers.get(server))
-        self._logger.debug('Server config is updated to {}'.format(server))
+        self._logger.debug('Server config is updated to %s', server)
 
     def _patch(self):
         shell.get_config = lambda _: self._config
         self._logger.debug('get_config patched successful.')
 
+    @timed('local.control')
     def control(self, action):
+        # Mark the action pending before the slow server selection, so a
+        # second caller sees it and does not fork another control process.
+        with self._pending_lock:
+            if self._pending == action:
+                self._logger.debug('Action<%s> is already pending.', action)
+                return False
+            self._pending = action
+        try:
+            pid = self._fork(action)
+        except Exception:
+            self._clear_pending(action)
+            raise
+        if pid != 0:
+            self._logger.debug('Control process return. child: %s', pid)
+            GLib.child_watch_add(
+                GLib.PRIORITY_DEFAULT, pid, self._on_child_exit, action
+            )
+            return True
+
+        self._logger.debug('Control sslocal...')
+        main()
+
+    def _fork(self, action):
+        count('local.' + action)
         self._config['daemon'] = action
-        self._logger.debug('Receive action<{}> for sslocal.'.format(action))
+        self._logger.debug('Receive action<%s> for sslocal.', action)
         if action == 'start':
             if not self._server:
                 srv = self.select_server()
                 self.set_server(srv)
-                self._logger.debug('Ready to connect to {}'.format(self._server))
+                self._logger.debug('Ready to connect to %s', self._server)
             self.compat_local()
         self.compat_proc()
-        pid = os.fork()
-        if pid != 0:
-            self._logger.debug('Control process return. child: {}'.format(pid))
-            os.wait()
-            return True
+        return os.fork()
 
-        self._logger.debug('Control sslocal...')
-        main()
+    def _clear_pending(self, action):
+        with self._pending_lock:
+            if self._pending == action:
+                self._pending = None
 
     def select_server(self):
         result = {}
@@ -70,28 +104,82 @@ class Local:
         if 'local_port' not in self._config:
             self._config.local_port = int(self._config.port)
 
+    def _on_child_exit(self, pid, status, action):
+        self._clear_pending(action)
+        self._logger.debug(
+            'Control process<%s> for action<%s> exited with %s',
+            pid,
+            action,
+            status
+        )
+        if action == 'stop':
+            self._set_alive(False)
+        else:
+            self.probe()
+
+    def add_watcher(self, func):
+        self._watchers.append(func)
+
+    def _set_alive(self, alive):
+        changed = alive != self._alive
+        self._alive = alive
+        if changed:
+            self._logger.debug('sslocal liveness changed to %s', alive)
+            for watcher in self._watchers:
+                watcher(alive)
+
     @property
-    def is_running(self):
-        if not os.path.exists(self._config.pid_file):
-            return False
+    def pending(self):
+        return self._pending
 
-        with open(self._config.pid_file) as pid_file:
-            pid = int(pid_file.read().strip())
+    @property
+    def is_running(self):
+        return self._alive
 
+    def _read_pid(self):
         try:
+            with open(self._config.pid_file) as pid_file:
+                pid = int(pid_file.read().strip())
             os.kill(pid, 0)
-        except ProcessLookupError:
+        except (OSError, ValueError):
+            return None
+        return pid
+
+    def probe(self, callback=None):
+        if callback:
+            self._probing.append(callback)
+        if self._probe_in_flight:
+            return False
+
+        if self._read_pid() is None:
+            self._finish_probe(False)
             return False
 
-        sock = socket.socket()
-        sock.settimeout(0.01)
+        self._probe_in_flight = True
+        client = Gio.SocketClient.new()
+        client.set_timeout(1)
+        client.connect_to_host_async(
+            self._config.address,
+            int(self._config.port),
+            None,
+            self._on_probe,
+            None
+        )
+        return True
+
+    def _on_probe(self, client, result, data):
         try:
-            sock.connect((self._config.address, int(self._config.port)))
-            running = True
-        except ConnectionRefusedError:
-            running = False
-        finally:
-            sock.shutdown(socket.SHUT_RD)
-            sock.close()
-
-        return running
+            connection = client.connect_to_host_finish(result)
+            connection.close(None)
+            alive = True
+        except GLib.Error as e:
+            self._logger.debug('sslocal port probe failed: %s', e)
+            alive = False
+        self._finish_probe(alive)
+
+    def _finish_probe(self, alive):
+        self._probe_in_flight = False
+        callbacks, self._probing = self._probing, []
+        self._set_alive(alive)
+        for callback in callbacks:
+            callback(alive)
@@ -1,8 +1,84 @@
 # coding: utf8
 
+import os
+import queue
+import atexit
 import logging
+import logging.config
+import logging.handlers
 
+PACKAGE = __name__.rpartition('.')[0]
 
-def _load_logger():
-    from .config import Config
-    logging.config.dictConfig(Config.logger)
+_listener = None
+
+
+def level_names(levels):
+    """``{logger: level}`` with short module names under the package.
+
+    ``{'httpproxy': 'DEBUG'}`` sets ``shadowsocks_pygi.httpproxy``.
+    """
+    return {
+        name if '.' in name or not PACKAGE else PACKAGE + '.' + name:
+            level.upper() if isinstance(level, str) else level
+        for name, level in (levels or {}).items()
+    }
+
+
+def setup(config, level='INFO', levels=None):
+    """Configure logging from the dict ``config``, writing in background.
+
+    The handlers of ``config`` are moved behind a ``QueueListener``
+    thread. A log call that passes the level still merges its arguments
+    into the message, and renders any traceback, in the calling thread
+    (``QueueHandler.prepare``); the handlers format the line and write it
+    in the listener thread. Calls below the level cost a level check.
+    ``levels`` overrides the level of single modules, ``level`` is the
+    root level.
+    """
+    global _listener
+    stop()
+    logging.config.dictConfig(config)
+
+    root = logging.getLogger()
+    root.setLevel(level.upper())
+    for name, module_level in level_names(levels).items():
+        logging.getLogger(name).setLevel(module_level)
+
+    handlers = root.handlers[:]
+    for handler in handlers:
+        root.removeHandler(handler)
+    records = queue.Queue()
+    root.addHandler(logging.handlers.QueueHandler(records))
+    _listener = logging.handlers.QueueListener(
+        records, *handlers, respect_handler_level=True
+    )
+    _listener.start()
+    return _listener
+
+
+def _after_fork_in_child():
+    # The writer thread does not survive a fork, so a forked child, e.g.
+    # sslocal, writes to the handlers directly.
+    global _listener
+    if _listener is None:
+        return
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        if isinstance(handler, logging.handlers.QueueHandler):
+            root.removeHandler(handler)
+    for handler in _listener.handlers:
+        root.addHandler(handler)
+    _listener = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+@atexit.register
+def stop():
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
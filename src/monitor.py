@@ -0,0 +1,139 @@
+# coding: utf8
+
+import os
+import json
+import logging
+
+from gi.repository import Gio, GLib
+
+from .config import ConfigItem
+
+
+class ConfigMonitor:
+    """Watches the config directory and the user rules for outside edits.
+
+    File events are coalesced for ``delay`` milliseconds, then every
+    touched path is compared with what is loaded, so only servers or
+    sections that really changed are reloaded. Callbacks connected with
+    ``connect`` receive ``(kind, name, action)``, where kind is one of
+    'server', 'section' or 'rules'.
+
+    Paths with changes ``config.writer`` has not written yet, and files
+    holding just what it wrote last, are skipped: there memory is newer
+    than, or the same as, the disk.
+    """
+
+    def __init__(self, config, delay=300):
+        self.logger = logging.getLogger(__name__)
+        self.config = config
+        self.delay = delay
+
+        self._monitors = []
+        self._callbacks = []
+        self._pending = set()
+        self._source = None
+
+    def connect(self, callback):
+        self._callbacks.append(callback)
+
+    def start(self):
+        paths = [self.config.path, os.path.dirname(self.config.pac.user_rules)]
+        if not self.config.store:
+            paths.append(self.config.servers_path)
+        for path in set(paths):
+            monitor = Gio.File.new_for_path(path).monitor_directory(
+                Gio.FileMonitorFlags.WATCH_MOVES, None
+            )
+            monitor.connect('changed', self._on_changed)
+            self._monitors.append(monitor)
+        self.logger.debug('Monitoring %s', ', '.join(paths))
+        return True
+
+    def stop(self):
+        for monitor in self._monitors:
+            monitor.cancel()
+        self._monitors = []
+        if self._source is not None:
+            GLib.source_remove(self._source)
+            self._source = None
+
+    def _on_changed(self, monitor, changed, other, event):
+        for gfile in (changed, other):
+            if gfile is not None and gfile.get_path():
+                self._pending.add(gfile.get_path())
+        if self._source is not None:
+            GLib.source_remove(self._source)
+        self._source = GLib.timeout_add(self.delay, self._flush)
+
+    def _flush(self):
+        self._source = None
+        pending, self._pending = self._pending, set()
+        sections = {
+            filename: section
+            for section, (filename, _) in self.config.sections().items()
+        }
+        for path in sorted(pending):
+            if self._own(path):
+                continue
+            if path == self.config.pac.user_rules:
+                self._emit('rules', None, 'changed')
+            elif path in sections:
+                self._reload_section(sections[path], path)
+            elif os.path.dirname(path) == self.config.servers_path \
+                    and path.endswith('.json') and not self.config.store:
+                self._reload_server(path)
+        return False
+
+    def _own(self, path):
+        writer = self.config.writer
+        if writer.pending(path):
+            return True
+        written = writer.written(path)
+        if written is None:
+            return False
+        try:
+            with open(path, encoding='utf8') as written_file:
+                return written_file.read() == written
+        except OSError:
+            return False
+
+    def _reload_section(self, section, path):
+        if not os.path.isfile(path):
+            return
+        try:
+            loaded = self.config._load(path)
+        except (ValueError, GLib.Error) as e:
+            self.logger.warning('Ignore broken %s: %s', path, e)
+            return
+        item = self.config[section]
+        if all(item.get(k) == v for k, v in loaded.items()):
+            return
+        item.update(loaded)
+        self.logger.info('Section<%s> reloaded from %s', section, path)
+        self._emit('section', section, 'changed')
+
+    def _reload_server(self, path):
+        name = os.path.basename(path).rsplit('.json', 1)[0]
+        servers = self.config.servers
+        if not os.path.isfile(path):
+            if name in servers:
+                servers.pop(name)
+                self._emit('server', name, 'removed')
+            return
+        try:
+            with open(path, encoding='utf8') as server_file:
+                content = ConfigItem(json.load(server_file))
+        except (OSError, ValueError) as e:
+            self.logger.warning('Ignore broken %s: %s', path, e)
+            return
+        if name not in servers:
+            servers[name] = content
+            self._emit('server', name, 'added')
+        elif servers[name] != content:
+            servers[name] = content
+            self._emit('server', name, 'changed')
+
+    def _emit(self, kind, name, action):
+        self.logger.debug('Config %s<%s> %s', kind, name, action)
+        for callback in self._callbacks:
+            callback(kind, name, action)
@@ -1,29 +1,110 @@
 # coding: utf8
 
 
+import time
 import logging
+import threading
 
 from gettext import gettext as _
 
-import gi
-gi.require_version('Notify', '0.7')
-from gi.repository import GLib, Notify   # noqa
+from gi.repository import GLib, Gio
 
 from .config import Config  # noqa
+from .tasks import AsyncCall
 
-Notify.init(Config.application_name)
 
+class Notifier:
+    """The single way to notify the desktop.
 
-class Notify:
-    notify = Notify.Notification().new(
-        summary=Config.application_name,
-        icon=Config.application.icon
-    )
+    Messages of a category arriving within ``window`` ms are coalesced
+    into one notification, and a category is shown at most once every
+    ``interval`` seconds (``intervals`` overrides it per category); what
+    arrives meanwhile is folded into the next one. ``show`` is safe to
+    call from any thread and never blocks.
 
-    def __init__(self):
+    Notifications are sent with ``Gio.Notification`` once ``app`` is
+    registered, which is an async D-Bus call, or else with libnotify in a
+    worker thread. Either way a category replaces its previous
+    notification instead of stacking a new one.
+    """
+
+    def __init__(self, app=None, window=1000, interval=10, intervals=None):
         self.logger = logging.getLogger(__name__)
+        self.app = app
+        self.window = window
+        self.interval = interval
+        self.intervals = dict(intervals or {})
+
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._sources = {}
+        self._last = {}
+        self._libnotify = {}
+
+    def show(self, text='', category='general'):
+        with self._lock:
+            texts = self._pending.setdefault(category, [])
+            texts.append(text)
+            if category not in self._sources:
+                self._schedule(category, self.window / 1000)
+        self.logger.debug(
+            _('Queue notify message<%s>: %s'), category, text
+        )
+        return True
+
+    def _schedule(self, category, delay):
+        wait = self._last.get(category, -1e9) + \
+            self.intervals.get(category, self.interval) - time.monotonic()
+        delay = max(delay, wait)
+        self._sources[category] = GLib.timeout_add(
+            int(delay * 1000), self._flush, category
+        )
+
+    def _flush(self, category):
+        with self._lock:
+            self._sources.pop(category, None)
+            texts = self._pending.pop(category, [])
+            self._last[category] = time.monotonic()
+        if not texts:
+            return False
+        text = texts[-1]
+        if len(texts) > 1:
+            text = _('{} (and {} more)').format(text, len(texts) - 1)
+        self.send(category, text)
+        return False
+
+    def send(self, category, text):
+        """Send one notification right now, on the main loop."""
+        self.logger.debug(
+            _('Show notify message<%s>: %s'), category, text
+        )
+        if self.app is not None and self.app.get_is_registered():
+            notification = Gio.Notification.new(Config.application_name)
+            notification.set_body(text)
+            notification.set_icon(Gio.ThemedIcon.new('network-vpn-symbolic'))
+            return self.app.send_notification(category, notification)
+        return AsyncCall(self._send_libnotify, category, text)
+
+    def _send_libnotify(self, category, text):
+        import gi
+        gi.require_version('Notify', '0.7')
+        from gi.repository import Notify
+        if not Notify.is_initted():
+            Notify.init(Config.application_name)
+        notification = self._libnotify.get(category)
+        if notification is None:
+            notification = Notify.Notification.new(
+                Config.application_name, text, Config.application.icon
+            )
+            self._libnotify[category] = notification
+        else:
+            notification.update(Config.application_name, text,
+                                Config.application.icon)
+        return notification.show()
 
-    def show(self, text=''):
-        self.notify.update(summary=Config.application_name, body=text)
-        self.logger.debug(_('Show notify message: {}').format(text))
-        return self.notify.show()
+    def clear(self):
+        with self._lock:
+            for source in self._sources.values():
+                GLib.source_remove(source)
+            self._sources = {}
+            self._pending = {}
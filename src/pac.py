@@ -1,29 +1,99 @@
 # coding: utf8
 
+import io
 import os
 import re
+import gzip
 import json
 import time
 import base64
+import hashlib
+import tempfile
 import requests
 
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError
 from urllib.parse import unquote, urlparse
 
+from .cidr import CidrSet
+from .resolver import resolver
+from .instrument import timed
 from .publicsuffix import PublicSuffixList
 
 __version__ = '0.0.1'
 
 
+class _ResolvedConnection:
+    """Connect to the addresses cached by the shared resolver.
+
+    Only the address connected to changes; the Host header and the tls
+    server name are still the host of the url.
+    """
+
+    def _new_conn(self):
+        host = self._dns_host
+        error = None
+        try:
+            for *_, sockaddr in resolver.resolve(host, self.port):
+                self._dns_host = sockaddr[0]
+                try:
+                    return super()._new_conn()
+                except ConnectTimeoutError as e:
+                    error = e
+        finally:
+            self._dns_host = host
+        raise error or OSError('getaddrinfo returns an empty list')
+
+
+class _HTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = type(
+        'HTTPConnection', (_ResolvedConnection, HTTPConnection), {}
+    )
+
+
+class _HTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = type(
+        'HTTPSConnection', (_ResolvedConnection, HTTPSConnection), {}
+    )
+
+
+class ResolverAdapter(requests.adapters.HTTPAdapter):
+    """Direct requests resolve hosts through the shared resolver.
+
+    A name that failed lately fails again at once, so a blocked gfwlist
+    host falls back to the proxy without another slow lookup. Proxied
+    requests are left to the proxy.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _HTTPConnectionPool,
+            'https': _HTTPSConnectionPool,
+        }
+
+
 class Pac:
+    # Parsed gfwlist of the last generation, so that rebuilding after an
+    # edit of the user rules only parses the user rules again.
+    _gfwlist_cache = (None, None)
+
     def __init__(self, config={}):
         self._pac = None
+        self.digest = None
         self.config = config
         self._proxies = {}
         self.generated_at = time.strftime(
             '%a, %d %b %Y %H:%M:%S %z',
             time.localtime()
         )
+        self.gfwlist = []
+        self.gfwlist_from = ''
         self.gfwlist_modified = ''
+        self.user_rules = []
+        self.direct_ranges = CidrSet()
+        self.proxy_ranges = CidrSet()
         self.proxy_lst = []
         self.direct_lst = []
         self.user_proxy_lst = []
@@ -47,7 +117,11 @@ class Pac:
     def fetch_remote_gfwlist(self, url=None):
         if not url:
             url = self.config.pac.gfwlist_url
-        response = requests.get(url, proxies=self._proxies)
+        with requests.Session() as session:
+            session.mount('http://', ResolverAdapter())
+            session.mount('https://', ResolverAdapter())
+            response = session.get(url, proxies=self._proxies, timeout=30)
+        response.raise_for_status()
 
         self.gfwlist = '! {}'.format(self.decode_gfwlist(response.text)) \
             .splitlines()
@@ -60,6 +134,22 @@ class Pac:
                 break
         return True
 
+    def refresh(self, proxy=None):
+        """Fetch gfwlist and regenerate the pac file.
+
+        The gfwlist is fetched directly first and through ``proxy`` when
+        that fails. Returns False when the pac file is already up to date.
+        """
+        try:
+            self.fetch_remote_gfwlist()
+        except (OSError, requests.RequestException):
+            if not proxy:
+                raise
+            self.set_proxy(http=proxy, https=proxy)
+            self.fetch_remote_gfwlist()
+        self.fetch_user_rules()
+        return self.generate().save()
+
     def fetch_local_gfwlist(self, path=None):
         with open(path) as _gfwlist:
             self.gfwlist = '! {}'.format(self.decode_gfwlist(_gfwlist.read())) \
@@ -78,21 +168,61 @@ class Pac:
         with open(path) as user_rule:
             self.user_rules = user_rule.read().splitlines()
 
-    def generate(self, force=False):
-        gfwlist = self.gfwlist
-
-        self.direct_lst, self.proxy_lst = self.parse_rules(gfwlist)
+    def fetch_ranges(self):
+        """Load the direct and proxy CIDR lists named in the pac config."""
+        if self.config.pac.get('direct_networks'):
+            self.direct_ranges = CidrSet.from_file(
+                self.config.pac.direct_networks
+            )
+        if self.config.pac.get('proxy_networks'):
+            self.proxy_ranges = CidrSet.from_file(
+                self.config.pac.proxy_networks
+            )
+
+    def parse(self):
+        key = hashlib.sha1('\n'.join(self.gfwlist).encode('utf8')).digest()
+        cached_key, parsed = Pac._gfwlist_cache
+        if cached_key != key:
+            parsed = self.parse_rules(self.gfwlist)
+            Pac._gfwlist_cache = (key, parsed)
+        self.direct_lst, self.proxy_lst = parsed
         self.user_direct_lst, self.user_proxy_lst = \
             self.parse_rules(self.user_rules)
+        self.fetch_ranges()
+        return self
+
+    def rule_groups(self):
+        """Parsed rules as ``(direct, proxy)`` pairs in pac matching order.
+        """
+        return [
+            (self.user_direct_lst, self.user_proxy_lst),
+            (self.direct_lst, self.proxy_lst)
+        ]
+
+    @timed('pac.generate')
+    def generate(self, force=False):
+        self.parse()
+
+        compress = self.config.pac.compress
+        self._pac = self.render(compress)
+        # The generation time is left out so that regenerating identical
+        # rules does not count as a change.
+        self.digest = hashlib.sha256(
+            self.render(compress, generated='').encode('utf8')
+        ).hexdigest()
+        return self
 
-        self._pac = self.template().replace('__version__', __version__) \
-            .replace('__generated__', self.generated_at) \
+    def render(self, compress=False, generated=None):
+        if generated is None:
+            generated = self.generated_at
+        return self.template(compress).replace('__version__', __version__) \
+            .replace('__generated__', generated) \
             .replace('__modified__', self.gfwlist_modified) \
             .replace('__gfwlist_from__', self.gfwlist_from) \
             .replace('__proxy_host__', self.config.local.address) \
             .replace('__proxy_port__', str(self.config.local.port)) \
-            .replace('__rules__', self.dumps())
-        return self
+            .replace('__rules__', self.dumps(compress)) \
+            .replace('__ranges__', self.dumps_ranges())
 
     def set_proxy(self, http=None, https=None):
         if http:
@@ -156,29 +286,141 @@ class Pac:
             proxy_lst.append(domain)
         return proxy_lst, direct_lst
 
-    def dumps(self):
+    def dumps(self, compress=None):
+        if compress is None:
+            compress = self.config.pac.compress
         return json.dumps(
             [
                 [self.user_direct_lst, self.user_proxy_lst],
                 [self.direct_lst, self.proxy_lst]
             ],
-            indent=None if self.config.pac.compress else 2,
-            separators=(',', ':') if self.config.pac.compress else None
+            indent=None if compress else 2,
+            separators=(',', ':') if compress else None
+        )
+
+    def dumps_ranges(self):
+        # Only IPv4 fits in the numbers of a pac script.
+        return json.dumps(
+            [self.direct_ranges.flat(4), self.proxy_ranges.flat(4)],
+            separators=(',', ':')
         )
 
-    def template(self):
-        if self.config.pac.compress:
+    def template(self, compress=None):
+        if compress is None:
+            compress = self.config.pac.compress
+        if compress:
             return ResourceData('pac-tpl.min.js').read()
         return ResourceData('pac-tpl.js').read()
 
+    @staticmethod
+    def digest_path(path):
+        return path + '.sha256'
+
+    @staticmethod
+    def minified_path(path):
+        return os.path.splitext(path)[0] + '.min.pac'
+
+    def saved_digest(self):
+        try:
+            with open(self.digest_path(self.config.pac.path)) as digest:
+                return digest.read().strip()
+        except OSError:
+            return None
+
+    def variants(self):
+        """Names of the extra files written next to the pac file."""
+        pac = self.config.pac
+        return [
+            name for name, enabled in (
+                ('gzip', pac.get('gzip')),
+                ('minified', pac.get('minified') and not pac.compress)
+            ) if enabled
+        ]
+
     def save(self, rules=None):
-        if not rules:
+        """Write the pac file, and its variants, only when it changed.
+
+        Returns False when the digest stored next to the pac file matches.
+        """
+        digest = self.digest
+        if rules:
+            digest = hashlib.sha256(rules.encode('utf8')).hexdigest()
+        else:
             rules = self._pac
-        with open(self.config.pac.path, 'w') as pac_file:
-            pac_file.write(rules)
+        variants = self.variants()
+        if variants:
+            # Enabling a variant has to write it, even for the same rules.
+            digest = hashlib.sha256(
+                '{}:{}'.format(digest, ','.join(variants)).encode('utf8')
+            ).hexdigest()
+        path = self.config.pac.path
+        if os.path.isfile(path) and self.saved_digest() == digest:
+            return False
+
+        content = rules.encode('utf8')
+        atomic_write(path, content)
+        if 'gzip' in variants:
+            atomic_write(path + '.gz', gzip_bytes(content))
+        if 'minified' in variants:
+            minified = self.render(True).encode('utf8')
+            atomic_write(self.minified_path(path), minified)
+            if 'gzip' in variants:
+                atomic_write(
+                    self.minified_path(path) + '.gz',
+                    gzip_bytes(minified)
+                )
+        atomic_write(self.digest_path(path), digest.encode('utf8'))
         return True
 
 
+def last_refresh(config):
+    """Unix time of the last gfwlist fetch, None without a pac file.
+
+    Every fetch rewrites the local gfwlist, while the pac file is only
+    replaced when its rules changed.
+    """
+    if not os.path.isfile(config.pac.path):
+        return None
+    for path in (config.pac.local_gfwlist, config.pac.path):
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            continue
+    return None
+
+
+def gzip_bytes(content):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as gz:
+        gz.write(content)
+    return buf.getvalue()
+
+
+def atomic_write(path, content):
+    """Replace ``path`` with ``content`` so readers never see a partial file.
+    """
+    dirname = os.path.dirname(path) or '.'
+    fd, tmp = tempfile.mkstemp(
+        prefix='.' + os.path.basename(path) + '.',
+        dir=dirname
+    )
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(content)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    dir_fd = os.open(dirname, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
 class ResourceData:
     def __init__(self, filename):
         self._file = os.path.join(
@@ -0,0 +1,162 @@
+# coding: utf8
+
+import os
+import hashlib
+import logging
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from email.utils import formatdate, parsedate_to_datetime
+
+from .pac import Pac, gzip_bytes
+
+
+class _PacRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'shadowsocks-pygi'
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        return self._send(body=False)
+
+    def do_GET(self):
+        return self._send(body=True)
+
+    def _send(self, body):
+        pac = self.server.pac_server.snapshot()
+        if pac is None:
+            self.send_error(404)
+            return
+
+        content, compressed, etag, mtime = pac
+        last_modified = formatdate(mtime, usegmt=True)
+        if self._not_modified(etag, mtime):
+            self.send_response(304)
+            self._headers(etag, last_modified)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        accept = self.headers.get('Accept-Encoding', '')
+        if 'gzip' in accept:
+            content = compressed
+        self.send_response(200)
+        self._headers(etag, last_modified)
+        self.send_header('Content-Type', 'application/x-ns-proxy-autoconfig')
+        self.send_header('Content-Length', str(len(content)))
+        if content is compressed:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        if body:
+            self.wfile.write(content)
+
+    def _headers(self, etag, last_modified):
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified)
+        self.send_header(
+            'Cache-Control',
+            'max-age={}'.format(self.server.pac_server.max_age)
+        )
+        self.send_header('Vary', 'Accept-Encoding')
+
+    def _not_modified(self, etag, mtime):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return etag in [t.strip() for t in if_none_match.split(',')] \
+                or if_none_match.strip() == '*'
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(mtime) <= since
+        return False
+
+    def log_message(self, format, *args):
+        self.server.pac_server.logger.debug(
+            '%s - ' + format, self.address_string(), *args
+        )
+
+
+class _HTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class PacServer:
+    """Serves the generated pac file over http from memory."""
+
+    def __init__(self, config):
+        self.logger = logging.getLogger(__name__)
+        self.config = config
+        self.max_age = config.pac.get('serve_max_age', 300)
+
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        address, port = self._server.server_address[:2]
+        return 'http://{}:{}/{}'.format(
+            address, port, os.path.basename(self.config.pac.path)
+        )
+
+    @property
+    def serving(self):
+        return self._server is not None
+
+    def snapshot(self):
+        with self._lock:
+            return self._snapshot
+
+    def reload(self):
+        path = self.config.pac.path
+        try:
+            with open(path, 'rb') as pac_file:
+                content = pac_file.read()
+            mtime = os.path.getmtime(path)
+        except OSError as e:
+            self.logger.warning('Can not load pac file: %s', e)
+            return False
+
+        try:
+            with open(Pac.digest_path(path)) as digest_file:
+                digest = digest_file.read().strip()
+        except OSError:
+            digest = hashlib.sha256(content).hexdigest()
+        # Weak, since the same tag covers the gzip and identity encodings.
+        etag = 'W/"{}"'.format(digest[:32])
+        with self._lock:
+            if self._snapshot and self._snapshot[2] == etag:
+                return False
+            self._snapshot = (content, gzip_bytes(content), etag, mtime)
+        self.logger.info('Pac file reloaded, etag: %s', etag)
+        return True
+
+    def start(self):
+        if self._server:
+            return True
+        self.reload()
+        self._server = _HTTPServer(
+            (self.config.pac.serve_address, int(self.config.pac.serve_port)),
+            _PacRequestHandler
+        )
+        self._server.pac_server = self
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        self.logger.info('Pac server is listening on %s', self.url)
+        return True
+
+    def stop(self):
+        if not self._server:
+            return True
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        self._thread = None
+        self.logger.info('Pac server is stopped.')
+        return True
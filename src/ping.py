@@ -6,6 +6,9 @@ import socket
 
 from functools import reduce
 
+from .resolver import resolver
+from .instrument import timed
+
 
 class Ping:
 
@@ -21,29 +24,41 @@ class Ping:
         self._conn_times = []
 
         self.socket = socket.socket
+        self._proxied = False
 
     def proxy(self, addr='127.0.0.1', port=1080):
         import socks
         socks.set_default_proxy(socks.SOCKS5, addr, int(port))
         self.socket = socks.socksocket
+        self._proxied = True
+
+    def _address(self):
+        if self._proxied:
+            return self._host, self._port
+        return resolver.resolve(
+            self._host, self._port, socket.AF_INET
+        )[0][4]
 
     def _create_socket(self, family, _type):
         sock = self.socket(family, _type)
         sock.settimeout(self._timeout)
         return sock
 
+    @timed('ping.ping')
     def ping(self, count=4):
+        address = self._address()
         for n in range(count + 1):
             sock = self._create_socket(socket.AF_INET, socket.SOCK_STREAM)
             start = time.time()
             try:
-                sock.connect((self._host, self._port))
+                sock.connect(address)
                 sock.shutdown(socket.SHUT_RD)
                 stop = time.time()
 
                 self._conn_times.append((stop - start) * 1000)
-            except socket.timeout:
-                self._failed -= 1
+                self._successed += 1
+            except OSError:
+                self._failed += 1
 
             finally:
                 sock.close()
@@ -64,6 +79,10 @@ class Ping:
             self._successed / (self._failed + self._successed) * 100
         )
 
+    @property
+    def loss(self):
+        return self._failed / (self._failed + self._successed) * 100
+
     @property
     def max(self):
         return max(self._conn_times)
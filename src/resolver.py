@@ -0,0 +1,167 @@
+# coding: utf8
+
+import time
+import socket
+import logging
+import ipaddress
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .instrument import stats
+
+
+class Resolver:
+    """A shared, bounded cache in front of ``getaddrinfo``.
+
+    The system resolver does not expose record TTLs, so entries live for
+    ``ttl`` seconds and failures for ``negative_ttl`` seconds. Names looked
+    up at least ``prefetch_hits`` times are refreshed in the background
+    once they get within ``prefetch`` of expiry, so hot names never miss.
+    ``resolve`` and ``clock`` can be replaced, e.g. by stubs in tests.
+    """
+
+    def __init__(self, resolve=None, ttl=300, negative_ttl=30,
+                 max_size=1024, prefetch=0.1, prefetch_hits=3, workers=4,
+                 clock=None):
+        self.logger = logging.getLogger(__name__)
+
+        self._resolve = resolve or socket.getaddrinfo
+        self._clock = clock or time.monotonic
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.prefetch = prefetch
+        self.prefetch_hits = prefetch_hits
+
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._prefetching = set()
+        self._workers = workers
+        self._executor = None
+
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.prefetches = 0
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self._workers)
+            return self._executor
+
+    @staticmethod
+    def is_ip(host):
+        try:
+            ipaddress.ip_address(host)
+        except ValueError:
+            return False
+        return True
+
+    def resolve(self, host, port=0, family=socket.AF_UNSPEC,
+                type=socket.SOCK_STREAM):
+        if self.is_ip(host):
+            return self._resolve(host, port, family, type)
+
+        key = (host.lower(), port, family, type)
+        now = self._clock()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None or entry[0] <= now:
+                self.misses += 1
+                entry = None
+            else:
+                self._cache.move_to_end(key)
+                expires, result, ttl, hits = entry
+                self._cache[key] = (expires, result, ttl, hits + 1)
+                prefetch = hits + 1 >= self.prefetch_hits \
+                    and expires - now < ttl * self.prefetch \
+                    and key not in self._prefetching
+                if isinstance(result, Exception):
+                    self.negative_hits += 1
+                    prefetch = False
+                else:
+                    self.hits += 1
+                if prefetch:
+                    self.prefetches += 1
+                    self._prefetching.add(key)
+
+        if entry is None:
+            return self._lookup(key, raises=True)
+        if isinstance(result, Exception):
+            raise result
+        if prefetch:
+            self.executor.submit(self._lookup, key)
+        return result
+
+    def _lookup(self, key, raises=False):
+        try:
+            result = self._resolve(*key)
+            ttl = self.ttl
+        except OSError as e:
+            result = e
+            ttl = self.negative_ttl
+            self.logger.debug('Failed to resolve %s: %s', key[0], e)
+        with self._lock:
+            self._prefetching.discard(key)
+            hits = self._cache.get(key, (0, 0, 0, 0))[3]
+            if isinstance(result, Exception):
+                # Do not let a failed background refresh drop a good entry.
+                old = self._cache.get(key)
+                if not raises and old and not isinstance(old[1], Exception):
+                    return old[1]
+            self._cache[key] = (self._clock() + ttl, result, ttl, hits)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        if isinstance(result, Exception) and raises:
+            raise result
+        return result
+
+    def resolve_async(self, host, port=0, family=socket.AF_UNSPEC,
+                      type=socket.SOCK_STREAM):
+        """``resolve`` on the worker pool; returns a Future."""
+        return self.executor.submit(self.resolve, host, port, family, type)
+
+    def create_connection(self, address, timeout=None):
+        host, port = address[:2]
+        error = None
+        for family, type, proto, _, sockaddr in self.resolve(host, port):
+            sock = None
+            try:
+                sock = socket.socket(family, type, proto)
+                if timeout is not None:
+                    sock.settimeout(timeout)
+                sock.connect(sockaddr)
+                return sock
+            except OSError as e:
+                error = e
+                if sock is not None:
+                    sock.close()
+        raise error or OSError('getaddrinfo returns an empty list')
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.negative_hits + self.misses
+        return (self.hits + self.negative_hits) / lookups if lookups else 0.0
+
+    def stats(self):
+        return {
+            'size': len(self._cache),
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'prefetches': self.prefetches,
+            'hit_rate': self.hit_rate,
+        }
+
+
+resolver = Resolver()
+stats.register('resolver', resolver.stats)
@@ -7,11 +7,19 @@
 
 var proxy = 'SOCKS5 __proxy_host__:__proxy_port__';
 var rules = __rules__;
+var ranges = __ranges__;
 
 var lastRule = '';
 
 function FindProxyForURL(url, host) {
-    for (var i = 0; i < rules.length; i++) {
+    // User rules come first, so that they override the ranges too.
+    var ret = testHost(host, 0);
+    if (ret != undefined)
+        return ret;
+    ret = testIP(host);
+    if (ret != undefined)
+        return ret;
+    for (var i = 1; i < rules.length; i++) {
         ret = testHost(host, i);
         if (ret != undefined)
             return ret;
@@ -30,6 +38,33 @@ function testHost(host, index) {
     lastRule = '';
 }
 
+function testIP(host) {
+    if (!/^\d+\.\d+\.\d+\.\d+$/.test(host))
+        return undefined;
+    var parts = host.split('.');
+    var ip = ((+parts[0]) * 16777216) + ((+parts[1]) * 65536) +
+        ((+parts[2]) * 256) + (+parts[3]);
+    for (var i = 0; i < ranges.length; i++) {
+        if (inRanges(ip, ranges[i]))
+            return i % 2 == 0 ? 'DIRECT' : proxy;
+    }
+}
+
+// ranges are flat, sorted [start, end, start, end, ...] integer tables.
+function inRanges(ip, table) {
+    var lo = 0, hi = table.length / 2 - 1;
+    while (lo <= hi) {
+        var mid = (lo + hi) >> 1;
+        if (ip < table[2 * mid])
+            hi = mid - 1;
+        else if (ip > table[2 * mid + 1])
+            lo = mid + 1;
+        else
+            return true;
+    }
+    return false;
+}
+
 // REF: https://developer.mozilla.org/en-US/docs/Web/JavaScript/Reference/Global_Objects/String/endsWith
 if (!String.prototype.endsWith) {
     String.prototype.endsWith = function(searchString, position) {
@@ -1,4 +1,4 @@
 /* __version__ https://github.com/songww/shadowsocks-pygi */
-function FindProxyForURL(t,r){for(var e=0;e<rules.length;e++)if(ret=testHost(r,e),void 0!=ret)return ret;return"DIRECT"}function testHost(t,r){for(var e=0;e<rules[r].length;e++)for(var n=0;n<rules[r][e].length;n++)if(lastRule=rules[r][e][n],t==lastRule||t.endsWith("."+lastRule))return e%2==0?"DIRECT":proxy;lastRule=""}var proxy="SOCKS5 __proxy_host__:__proxy_port__",rules=__rules__,lastRule="";String.prototype.endsWith||(String.prototype.endsWith=function(t,r){var e=this.toString();("number"!=typeof r||!isFinite(r)||Math.floor(r)!==r||r>e.length)&&(r=e.length),r-=t.length;var n=e.indexOf(t,r);return-1!==n&&n===r});
+function FindProxyForURL(t,r){var ret=testHost(r,0);if(void 0!=ret)return ret;if(ret=testIP(r),void 0!=ret)return ret;for(var e=1;e<rules.length;e++)if(ret=testHost(r,e),void 0!=ret)return ret;return"DIRECT"}function testHost(t,r){for(var e=0;e<rules[r].length;e++)for(var n=0;n<rules[r][e].length;n++)if(lastRule=rules[r][e][n],t==lastRule||t.endsWith("."+lastRule))return e%2==0?"DIRECT":proxy;lastRule=""}function testIP(t){if(/^\d+\.\d+\.\d+\.\d+$/.test(t)){var r=t.split("."),e=16777216*+r[0]+65536*+r[1]+256*+r[2]+ +r[3];for(var n=0;n<ranges.length;n++)if(inRanges(e,ranges[n]))return n%2==0?"DIRECT":proxy}}function inRanges(t,r){for(var e=0,n=r.length/2-1;e<=n;){var i=e+n>>1;if(t<r[2*i])n=i-1;else{if(!(t>r[2*i+1]))return!0;e=i+1}}return!1}var proxy="SOCKS5 __proxy_host__:__proxy_port__",rules=__rules__,ranges=__ranges__,lastRule="";String.prototype.endsWith||(String.prototype.endsWith=function(t,r){var e=this.toString();("number"!=typeof r||!isFinite(r)||Math.floor(r)!==r||r>e.length)&&(r=e.length),r-=t.length;var n=e.indexOf(t,r);return-1!==n&&n===r});
 //! Generated: __generated__
 //! GFWList: __modified__ From __gfwlist_from__
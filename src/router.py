@@ -0,0 +1,110 @@
+# coding: utf8
+
+import logging
+import ipaddress
+
+from functools import lru_cache
+
+from .cidr import CidrSet
+
+DIRECT = 'DIRECT'
+PROXY = 'PROXY'
+
+
+class Router:
+    """Decides per host whether to go direct or through the proxy.
+
+    The decision follows the generated pac file: rule groups are tried in
+    order, within a group any matching direct rule wins over proxy rules,
+    and unmatched hosts go direct. Lookups walk the labels of the host, so
+    they cost O(labels) whatever the size of the rule sets.
+
+    IP addresses are matched against the direct and proxy CIDR ranges
+    after the user rules, the first group, and before the other groups.
+    With a ``resolver``, hostnames no domain rule matched are resolved
+    and their address is matched against the ranges too.
+    """
+
+    def __init__(self, groups, cache_size=4096, direct_ranges=None,
+                 proxy_ranges=None, resolver=None):
+        self.logger = logging.getLogger(__name__)
+        self.ranges = [
+            (direct_ranges or CidrSet(), DIRECT),
+            (proxy_ranges or CidrSet(), PROXY)
+        ]
+        self.resolver = resolver
+        self._groups = []
+        for direct, proxy in groups:
+            rules = dict.fromkeys(proxy, PROXY)
+            rules.update(dict.fromkeys(direct, DIRECT))
+            self._groups.append(rules)
+        self.decide = lru_cache(maxsize=cache_size)(self._decide)
+
+    @classmethod
+    def from_pac(cls, pac, cache_size=4096, resolver=None):
+        return cls(
+            pac.rule_groups(), cache_size,
+            pac.direct_ranges, pac.proxy_ranges,
+            resolver
+        )
+
+    @staticmethod
+    def suffixes(host):
+        labels = host.lower().rstrip('.').split('.')
+        return ['.'.join(labels[i:]) for i in range(len(labels))]
+
+    def _decide_address(self, address):
+        for ranges, decision in self.ranges:
+            if ranges.contains_int(int(address), address.version):
+                return decision
+        return None
+
+    @staticmethod
+    def _decide_rules(groups, suffixes):
+        for rules in groups:
+            decision = None
+            for suffix in suffixes:
+                matched = rules.get(suffix)
+                if matched == DIRECT:
+                    return DIRECT
+                decision = decision or matched
+            if decision:
+                return decision
+        return None
+
+    def _decide(self, host):
+        suffixes = self.suffixes(host)
+        decision = self._decide_rules(self._groups[:1], suffixes)
+        if decision:
+            return decision
+
+        try:
+            address = ipaddress.ip_address(host.strip('[]'))
+        except ValueError:
+            address = None
+        if address is not None:
+            decision = self._decide_address(address)
+            if decision:
+                return decision
+
+        decision = self._decide_rules(self._groups[1:], suffixes)
+        if decision:
+            return decision
+        if address is None and self.resolver \
+                and any(r for r, _ in self.ranges):
+            try:
+                addrinfo = self.resolver.resolve(host)
+            except OSError:
+                return DIRECT
+            for info in addrinfo:
+                address = ipaddress.ip_address(info[4][0].split('%')[0])
+                decision = self._decide_address(address)
+                if decision:
+                    return decision
+        return DIRECT
+
+    def is_direct(self, host):
+        return self.decide(host) == DIRECT
+
+    def cache_info(self):
+        return self.decide.cache_info()
@@ -0,0 +1,214 @@
+# coding: utf8
+
+import socket
+import logging
+import threading
+
+from gettext import gettext as _
+from concurrent.futures import ThreadPoolExecutor
+
+from gi.repository import Gtk, GLib, Pango
+
+from .ping import Ping
+from .resolver import resolver
+
+NAME, LATENCY, LOSS, ENABLED, GROUP = range(5)
+UNKNOWN = -1.0
+
+
+class ServerList:
+    """The model of the server list view.
+
+    Rows carry the name, the latency in ms and the loss in percent of the
+    last probe (``UNKNOWN`` until probed), the enabled flag and the group,
+    i.e. the subscription a server came from. The view shows ``sorted``,
+    a ``Gtk.TreeModelSort`` over a ``Gtk.TreeModelFilter`` of ``store``.
+
+    ``update`` may be called from any thread: changes are merged per
+    server and applied in one main loop callback every ``delay`` ms.
+    """
+
+    def __init__(self, delay=200):
+        self.logger = logging.getLogger(__name__)
+        self.delay = delay
+        self.store = Gtk.ListStore(str, float, float, bool, str)
+        self.filter = self.store.filter_new()
+        self.filter.set_visible_func(self._visible)
+        self.sorted = Gtk.TreeModelSort(model=self.filter)
+        self.sorted.set_sort_func(LATENCY, self._by_latency)
+        self.sorted.set_sort_column_id(NAME, Gtk.SortType.ASCENDING)
+        self.query = ''
+
+        self._rows = {}
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._source = None
+
+    @staticmethod
+    def row(name, config):
+        return [
+            name, UNKNOWN, UNKNOWN, bool(config.get('enabled', False)),
+            config.get('subscription') or ''
+        ]
+
+    def load(self, servers):
+        """Fill the store from ``{name: config}``, replacing every row."""
+        self.store.clear()
+        self._rows = {}
+        for name, config in servers.items():
+            self._rows[name] = self.store.append(self.row(name, config))
+        self.logger.debug('%s servers loaded.', len(self._rows))
+
+    def __contains__(self, name):
+        return name in self._rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def append(self, name, config):
+        if name in self._rows:
+            return self.update(name, **dict(zip(
+                ('enabled', 'group'), self.row(name, config)[ENABLED:]
+            )))
+        self._rows[name] = self.store.append(self.row(name, config))
+
+    def remove(self, name):
+        tree_iter = self._rows.pop(name, None)
+        if tree_iter is not None:
+            self.store.remove(tree_iter)
+        with self._lock:
+            self._pending.pop(name, None)
+
+    def rename(self, old, new):
+        tree_iter = self._rows.pop(old, None)
+        if tree_iter is not None:
+            self._rows[new] = tree_iter
+            self.store.set_value(tree_iter, NAME, new)
+
+    def update(self, name, latency=None, loss=None, enabled=None, group=None):
+        """Queue new column values of a server; thread safe."""
+        values = {
+            column: value for column, value in (
+                (LATENCY, latency), (LOSS, loss),
+                (ENABLED, enabled), (GROUP, group)
+            ) if value is not None
+        }
+        with self._lock:
+            self._pending.setdefault(name, {}).update(values)
+            if self._source is None:
+                self._source = GLib.timeout_add(self.delay, self._flush)
+
+    def _flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._source = None
+        for name, values in pending.items():
+            tree_iter = self._rows.get(name)
+            if tree_iter is not None and values:
+                self.store.set(tree_iter, values)
+        return False
+
+    def set_query(self, text):
+        self.query = text.strip().lower()
+        self.filter.refilter()
+
+    def _visible(self, model, tree_iter, data):
+        if not self.query:
+            return True
+        name, group = model.get(tree_iter, NAME, GROUP)
+        return self.query in (name or '').lower() or \
+            self.query in group.lower()
+
+    @staticmethod
+    def _by_latency(model, a, b, data):
+        # Servers not probed yet, or unreachable, go last.
+        a, b = model[a][LATENCY], model[b][LATENCY]
+        a, b = (a < 0, a), (b < 0, b)
+        return (a > b) - (a < b)
+
+    def view_iter(self, name):
+        """The iter of ``name`` in ``sorted``, None when filtered out."""
+        tree_iter = self._rows.get(name)
+        if tree_iter is None:
+            return None
+        found, tree_iter = self.filter.convert_child_iter_to_iter(tree_iter)
+        if not found:
+            return None
+        return self.sorted.convert_child_iter_to_iter(tree_iter)[1]
+
+    def probe(self, servers, workers=8, count=1, timeout=2):
+        """Probe every server of ``{name: config}``, updating the rows.
+
+        Runs in the calling thread and blocks until every probe is done.
+        Every host is looked up once, on the resolver's pool, while the
+        probes of the hosts resolved already run.
+        """
+        servers = list(servers.items())
+        lookups = {}
+        for _name, config in servers:
+            if config.server not in lookups:
+                lookups[config.server] = resolver.resolve_async(
+                    config.server, 0, socket.AF_INET
+                )
+
+        def probe(name, config):
+            try:
+                address = lookups[config.server].result()[0][4][0]
+                ping = Ping(address, int(config.server_port), timeout)
+                ping.ping(count)
+            except OSError as e:
+                self.logger.debug('Probe of %s failed: %s', name, e)
+                return self.update(name, latency=UNKNOWN, loss=100.0)
+            self.update(
+                name,
+                latency=ping.avg if ping.successed else UNKNOWN,
+                loss=ping.loss
+            )
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for name, config in servers:
+                executor.submit(probe, name, config)
+        return True
+
+    def create_columns(self, view):
+        """Show ``sorted`` in ``view``, with fixed size rows.
+
+        Fixed height mode lets the view measure one row only, instead of
+        every row of the model.
+        """
+        cell = Gtk.CellRendererText(ellipsize=Pango.EllipsizeMode.END)
+        column = Gtk.TreeViewColumn(_('_Server_List'), cell, text=NAME)
+        column.set_cell_data_func(cell, self._render_name)
+        column.set_sort_column_id(NAME)
+        column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+        column.set_expand(True)
+        view.append_column(column)
+
+        cell = Gtk.CellRendererText(xalign=1.0)
+        column = Gtk.TreeViewColumn(_('Latency'), cell)
+        column.set_cell_data_func(cell, self._render_latency)
+        column.set_sort_column_id(LATENCY)
+        column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+        column.set_fixed_width(96)
+        view.append_column(column)
+
+        view.set_fixed_height_mode(True)
+        view.set_headers_visible(True)
+        view.set_search_column(NAME)
+        view.set_model(self.sorted)
+
+    @staticmethod
+    def _render_name(column, cell, model, tree_iter, data):
+        enabled = model.get_value(tree_iter, ENABLED)
+        cell.set_property('weight', 700 if enabled else 400)
+
+    @staticmethod
+    def _render_latency(column, cell, model, tree_iter, data):
+        latency, loss = model.get(tree_iter, LATENCY, LOSS)
+        if latency < 0:
+            text = '-' if loss < 100 else '✕'
+        elif loss > 0:
+            text = '{:.0f} ms ({:.0f}%)'.format(latency, loss)
+        else:
+            text = '{:.0f} ms'.format(latency)
+        cell.set_property('text', text)
@@ -0,0 +1,111 @@
+# coding: utf8
+
+import os
+import json
+import sqlite3
+import logging
+import threading
+
+
+class ServerStore:
+    """Keeps every server profile in a single sqlite database.
+
+    Profiles are stored as the same json text as ``servers/<name>.json``,
+    with the name and the enabled flag indexed.
+    """
+
+    schema = '''
+        CREATE TABLE IF NOT EXISTS servers (
+            name TEXT PRIMARY KEY,
+            enabled INTEGER NOT NULL DEFAULT 0,
+            config TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS servers_enabled ON servers (enabled);
+    '''
+
+    def __init__(self, path):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(self.schema)
+
+    @staticmethod
+    def _row(name, config):
+        if not isinstance(config, str):
+            config = json.dumps(config)
+        enabled = bool(json.loads(config).get('enabled', False))
+        return name, int(enabled), config
+
+    def load(self):
+        """All profiles as ``{name: json text}``."""
+        with self._lock:
+            return dict(self._db.execute('SELECT name, config FROM servers'))
+
+    def get(self, name):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT config FROM servers WHERE name = ?', (name,)
+            ).fetchone()
+        return row and row[0]
+
+    def enabled(self):
+        with self._lock:
+            return [name for name, in self._db.execute(
+                'SELECT name FROM servers WHERE enabled = 1'
+            )]
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT count(*) FROM servers') \
+                .fetchone()[0]
+
+    def update(self, save=None, delete=()):
+        """Save and delete several profiles in one transaction.
+
+        ``save`` maps names to json text or dicts.
+        """
+        rows = [self._row(name, config) for name, config in
+                (save or {}).items()]
+        with self._lock, self._db:
+            self._db.executemany(
+                'DELETE FROM servers WHERE name = ?',
+                [(name,) for name in delete]
+            )
+            self._db.executemany(
+                'INSERT OR REPLACE INTO servers (name, enabled, config) '
+                'VALUES (?, ?, ?)',
+                rows
+            )
+        return True
+
+    def migrate(self, servers_path):
+        """Move ``servers/*.json`` into the store, in one transaction."""
+        if not os.path.isdir(servers_path):
+            return 0
+        profiles = {}
+        for entry in os.scandir(servers_path):
+            if not entry.name.endswith('.json'):
+                continue
+            with open(entry.path, encoding='utf8') as server_file:
+                profiles[entry.name.rsplit('.json', 1)[0]] = server_file.read()
+        if not profiles:
+            return 0
+        self.update(save=profiles)
+        migrated = servers_path + '.migrated'
+        os.makedirs(migrated, exist_ok=True)
+        for name in profiles:
+            os.replace(
+                os.path.join(servers_path, name + '.json'),
+                os.path.join(migrated, name + '.json')
+            )
+        self.logger.info(
+            'Migrated %s servers from %s', len(profiles), servers_path
+        )
+        return len(profiles)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,97 @@
+# coding: utf8
+
+from gettext import gettext as _
+
+from .pac import Pac, last_refresh
+from .config import Config
+from .router import Router
+from .resolver import resolver
+from .tasks import AsyncCall, due_in
+
+
+class Service:
+    """The background work of both the application and the daemon.
+
+    Mixed into classes providing ``logger``, ``scheduler``, ``sslocal``,
+    ``pac_server`` and ``http_proxy``; the servers may be None when they
+    are disabled.
+    """
+
+    health_check_interval = 30
+
+    def schedule_common_jobs(self, pac_callback=None):
+        """Add the gfwlist refresh and the sslocal health check jobs.
+
+        The first refresh is due ``update_interval`` after the last one,
+        right away when there is no pac file yet.
+        """
+        self.scheduler.add(
+            'gfwlist',
+            self.update_pac,
+            interval=Config.pac.update_interval,
+            jitter=Config.pac.update_jitter,
+            retry=Config.pac.update_retry,
+            threaded=True,
+            callback=pac_callback,
+            delay=due_in(Config.pac.update_interval, last_refresh(Config))
+        )
+        self.scheduler.add(
+            'health_check',
+            self.health_check,
+            interval=self.health_check_interval,
+            jitter=0.2
+        )
+
+    def update_pac(self):
+        self.logger.debug(_('Ready to update pac file..'))
+        proxy = None
+        if self.sslocal.is_running:
+            proxy = 'socks5://{}:{}'.format(
+                Config.local.address,
+                Config.local.port
+            )
+        pac = Pac(Config)
+        changed = pac.refresh(proxy)
+        Config.pac.gfwlist_modified = pac.gfwlist_modified
+        Config.defer('pac')
+        if not changed:
+            self.logger.info(_('Pac file is already up to date.'))
+            return False
+        if self.pac_server:
+            self.pac_server.reload()
+        self.load_router(pac)
+        self.logger.info(_('Pac file is updated.'))
+        return True
+
+    def load_router(self, pac=None):
+        if not Config.local.http_routing or not self.http_proxy:
+            return None
+        if pac is None:
+            pac = Pac(Config)
+            pac.fetch_user_rules()
+            pac.parse()
+        router = Router.from_pac(
+            pac,
+            resolver=resolver if Config.pac.resolve_networks else None
+        )
+        self.http_proxy.set_router(router)
+        return router
+
+    def wants_connection(self):
+        """Whether sslocal is supposed to be running now."""
+        return True
+
+    def health_check(self):
+        if not self.wants_connection() or self.sslocal.pending:
+            return True
+        return self.sslocal.probe(self._on_health_checked)
+
+    def _on_health_checked(self, alive):
+        if alive or self.sslocal.pending:
+            return
+        self.logger.info(_('sslocal is not running, reconnecting..'))
+        self.on_reconnect()
+        AsyncCall(self.sslocal.control, 'start')
+
+    def on_reconnect(self):
+        """Called on the main loop before sslocal is restarted."""
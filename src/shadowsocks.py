@@ -1,22 +1,34 @@
 #!/usr/bin/env python3
 # coding: utf8
 
-import os
 import logging
-import logging.config
 
 from gettext import gettext as _
 
 from gi.repository import Gtk, GLib, Gio  # noqa
 
 from .pac import Pac
+from .bypass import compile_ignore_hosts, PRIVATE_NETWORKS
+from .cidr import load_networks
+from .pacserver import PacServer
 from .local import Local
-from .notify import Notify
+from .monitor import ConfigMonitor
+from .notify import Notifier
 from .config import Config
 from .handler import Handler
+from .logger import setup as setup_logging
+from .ui import LazyBuilder
+from .serverlist import ServerList
+from .instrument import stats, process_uptime
+from .service import Service
+from .httpproxy import HTTPProxy
 from .gsettings import SystemProxy
 
-from .tasks import AsyncCall
+from .tasks import AsyncCall, Scheduler, due_in
+from .subscription import (
+    fetch_servers, import_servers, export_servers, check_subscription,
+    apply_diff, save_diff, last_checked
+)
 
 try:
     from shadowsocks.cryptor import method_supported
@@ -24,13 +36,14 @@ except ImportError as e:
     from shadowsocks.encrypt import method_supported
 
 
-class Shadowsocks(Gtk.Application):
-    ui = os.path.join(os.path.dirname(__file__), 'resources', 'shadowsocks.ui')
+class Shadowsocks(Service, Gtk.Application):
     methods = method_supported.keys()
 
     _signals = {
         'auto_connect': 'do_set_auto_connect',
         'auto_reconnect': 'do_set_auto_reconnect',
+        'instrument': 'do_set_instrument',
+        'profile': 'do_set_profile',
     }
 
     def __init__(self, *args, **kwargs):
@@ -42,33 +55,30 @@ class Shadowsocks(Gtk.Application):
         )
         self._logger()
         self.logger.info(_('Start..'))
+        self.add_main_option(
+            'import', ord('i'), GLib.OptionFlags.NONE, GLib.OptionArg.STRING,
+            _('Import servers from a subscription file or url'), 'SOURCE'
+        )
+        self.add_main_option(
+            'export', ord('e'), GLib.OptionFlags.NONE, GLib.OptionArg.FILENAME,
+            _('Export servers to a SIP008 json or base64 file'), 'FILE'
+        )
+        self.add_main_option(
+            'startup-time', 0, GLib.OptionFlags.NONE, GLib.OptionArg.NONE,
+            _('Print the time to the first window draw, then quit'), None
+        )
         self.window = None
-        self.builder = Gtk.Builder()
-        self.builder.set_translation_domain('shadowsocks-pygi')
         self.methods_map = {}
-
-        self.notify = Notify()
-
-        self.sslocal = Local()
-
-        self.builder.add_from_file(self.ui)
-        self.logger.debug(_('Load ui from {}').format(self.ui))
-
-        self.builder.connect_signals(Handler(self))
-        self.logger.debug(_('Connect signal from class<Handler>'))
-
-        self._signal_for_pac_menu()
-        self._signal_for_proxy_menu()
-        self._signal_for_connection_menu()
-
-        self.create_notification()
-
-        self._auto_connect()
+        self.server_list = None
+        self._measure_startup = False
 
     def _logger(self):
-        logging.config.dictConfig(Config.logger)
+        setup_logging(
+            Config.logger,
+            Config.application.log_level,
+            Config.application.log_levels
+        )
         self.logger = logging.getLogger(__name__)
-        self.logger.setLevel(logging.DEBUG)
 
     def do_activate(self):
         if not self.window:
@@ -76,98 +86,406 @@ class Shadowsocks(Gtk.Application):
             self.window = self.builder.get_object('ShadowsocksWindow')
             header = self.builder.get_object('HeaderBar')
             header.set_show_close_button(True)
-            menu_button = self.builder.get_object('MenuButton')
-            menu_button.set_popover(self.builder.get_object('MenuPop'))
+            if self._auto_connect_state():
+                self.builder.get_object('ConnectionControl').set_state(True)
             self.window.connect(
                 'delete-event',
                 lambda x, y: self.logger.debug(_('Window delete event.'))
             )
+            self._first_draw = self.window.connect(
+                'draw', self._on_first_draw
+            )
             self.window.set_titlebar(header)
             self.window.set_application(self)
             self.create_server_view()
-            self.create_supported_method_view()
         self.logger.debug(_('Show window..'))
         self.window.show_all()
 
+    def _on_first_draw(self, window, cr):
+        window.disconnect(self._first_draw)
+        elapsed = process_uptime()
+        self.logger.info(
+            _('First window draw %.0fms after start.'), elapsed * 1000
+        )
+        if self._measure_startup:
+            # Tagged: log records go to stdout too, also after it.
+            print('startup-time: {:.3f}'.format(elapsed), flush=True)
+            GLib.idle_add(self.quit)
+        else:
+            self.notify.show(_('Startup.'), 'state')
+        return False
+
     def do_startup(self):
+        # Only the primary instance starts up: remote ones, e.g. of
+        # --import, forward their command line and exit, so they must not
+        # bind ports, watch files or schedule jobs.
         self.logger.debug(_('Application start.'))
         Gtk.Application.do_startup(self)
 
+        self.notify = Notifier(
+            self, intervals={'reconnect': 60, 'pac': 60}
+        )
+
+        self.sslocal = Local()
+
+        self.scheduler = Scheduler()
+
+        self.pac_server = PacServer(Config)
+        if Config.pac.serve:
+            try:
+                self.pac_server.start()
+            except OSError as e:
+                self.logger.error(_('Failed to serve pac file: %s'), e)
+
+        self.http_proxy = HTTPProxy(Config)
+        if Config.local.http_proxy:
+            try:
+                self.http_proxy.start()
+            except OSError as e:
+                self.logger.error(_('Failed to start http proxy: %s'), e)
+        AsyncCall(self.load_router)
+
+        self.monitor = ConfigMonitor(Config)
+        self.monitor.connect(self._on_config_changed)
+        self.monitor.start()
+
+        self.handler = Handler(self)
+        self.builder = LazyBuilder(self.handler, 'shadowsocks-pygi')
+        self.builder.on_load(
+            'server-dialog', self.create_supported_method_view
+        )
+
+        self._signal_for_pac_menu()
+        self._signal_for_proxy_menu()
+        self._signal_for_connection_menu()
+        self._signal_for_debug_menu()
+
+        self._auto_connect()
+
+        self._schedule_jobs()
+
+    def do_shutdown(self):
+        self.do_destroy()
+        Gtk.Application.do_shutdown(self)
+
     def do_destroy(self):
         self.logger.debug(_('Application stop.'))
-        self.m.stop()
+        self.scheduler.stop()
+        self.notify.clear()
+        if stats.enabled:
+            self.do_dump_stats()
+        self.monitor.stop()
+        Config.flush()
+        self.pac_server.stop()
+        self.http_proxy.stop()
 
     def do_command_line(self, command_line):
         self.logger.debug(_('Application command line parser..'))
-        self.activate()
+        options = command_line.get_options_dict().end().unpack()
+        if 'import' in options:
+            # Fetching may take long, and runs in the primary instance;
+            # the servers are only added back on the main loop.
+            self.hold()
+            AsyncCall(
+                fetch_servers,
+                self._argument_path(command_line, options['import']),
+                Config.servers.copy(),
+                callback=lambda servers, error: self._on_import_fetched(
+                    command_line, servers, error
+                )
+            )
+        if 'export' in options:
+            filename = self._argument_path(command_line, options['export'])
+            format = 'sip008' if filename.endswith('.json') else 'base64'
+            with open(filename, 'w', encoding='utf8') as export_file:
+                export_file.write(export_servers(Config.servers, format))
+            command_line.print_(
+                _('{} servers exported.').format(len(Config.servers)) + '\n'
+            )
+        if 'startup-time' in options:
+            self._measure_startup = True
+            options.pop('startup-time')
+        if not options:
+            self.activate()
         return 0
 
+    @staticmethod
+    def _argument_path(command_line, argument):
+        """``argument`` relative to the directory the command ran in.
+
+        The primary instance may run elsewhere than the one forwarding
+        its command line. Urls are returned as they are.
+        """
+        if isinstance(argument, bytes):
+            argument = argument.decode('utf8')
+        if argument.startswith('http://') or argument.startswith('https://'):
+            return argument
+        return command_line.create_file_for_arg(argument).get_path()
+
+    def _on_import_fetched(self, command_line, servers, error):
+        if error:
+            return self._on_imported(command_line, None, error)
+        names = import_servers(Config, servers)
+        self._append_servers(names)
+        AsyncCall(
+            Config.save_servers, names,
+            callback=lambda result, error: self._on_imported(
+                command_line, names, error
+            )
+        )
+        return False
+
+    def _on_imported(self, command_line, names, error):
+        if error:
+            command_line.printerr(
+                _('Failed to import servers: {}').format(error) + '\n'
+            )
+            command_line.set_exit_status(1)
+        else:
+            command_line.print_(
+                _('{} servers imported.').format(len(names)) + '\n'
+            )
+        self.release()
+        return False
+
+    def _append_servers(self, names):
+        if not self.server_list:
+            return
+        for name in names:
+            self.server_list.append(name, Config.servers[name])
+
+    def _remove_servers(self, names):
+        if not self.server_list:
+            return
+        for name in names:
+            self.server_list.remove(name)
+
+    @staticmethod
+    def _subscriptions_snapshot():
+        """Copies of the servers and subscriptions, for the worker."""
+        return (
+            Config.servers.copy(),
+            [dict(s) for s in Config.application.subscriptions]
+        )
+
+    def check_subscriptions(self, snapshot):
+        """Diffs of every subscription, against ``snapshot`` only.
+
+        Runs in a worker; the diffs are applied on the main loop by
+        ``_on_subscriptions_checked``.
+        """
+        servers, subscriptions = snapshot
+        diffs = []
+        for subscription in subscriptions:
+            try:
+                diffs.append(check_subscription(servers, subscription))
+            except Exception as e:
+                self.logger.error(
+                    _('Failed to update subscription %s: %s'),
+                    subscription['url'], e
+                )
+        return diffs
+
+    def _on_subscriptions_checked(self, diffs, error):
+        for diff in diffs or []:
+            self.logger.info(_('Subscription updated: %s'), diff)
+            apply_diff(Config, diff)
+            self._remove_servers(diff.removed)
+            self._append_servers(list(diff.added) + list(diff.changed))
+            if diff:
+                AsyncCall(save_diff, Config, diff)
+        if diffs:
+            Config.defer('application')
+
     def do_set_auto_connect(self, action, state):
         self.logger.debug(
-            _('Auto_connect is selected. Current state is {}').format(state)
+            _('Auto_connect is selected. Current state is %s'), state
         )
         action.set_state(state)
         Config.application.auto_connect = state.print_(True)
-        Config.save_application()
+        Config.defer('application')
         self._auto_connect()
 
     def do_set_auto_reconnect(self, action, state):
         self.logger.debug(
-            _('Auto_Reconnect is selected. Current state is {}').format(state)
+            _('Auto_Reconnect is selected. Current state is %s'), state
         )
         action.set_state(state)
         Config.application.auto_reconnect = state.print_(True)
-        Config.save_application()
+        Config.defer('application')
+
+    def do_set_instrument(self, action, state):
+        action.set_state(state)
+        Config.application.instrument = state.print_(True)
+        Config.defer('application')
+        if state.unpack():
+            stats.enable(profile=self._profile_state())
+        else:
+            stats.disable()
+
+    def do_set_profile(self, action, state):
+        action.set_state(state)
+        Config.application.profile = state.print_(True)
+        Config.defer('application')
+        # Only on top of instrumentation, which reports the profile.
+        if state.unpack() and stats.enabled:
+            stats.start_profile()
+        elif not state.unpack():
+            stats.stop_profile()
+
+    def _profile_state(self):
+        profile = Config.application.get('profile', 'false')
+        return GLib.Variant.parse(None, profile, None, None).unpack()
+
+    def do_dump_stats(self, *args):
+        self.logger.info(_('Instrumentation:\n%s'), stats.report())
+        return stats.dump(
+            GLib.get_user_runtime_dir(),
+            Config.application_name + '-instrument'
+        )
 
     def do_update_pac(self, action, state):
-        def func(*args):
-            self.logger.debug(_('Ready to update pac file..'))
+        return self.scheduler.run_now('gfwlist')
+
+    def update_pac(self):
+        changed = super().update_pac()
+        if changed:
+            self.notify.show(_('Successful to update gfwlist'), 'pac')
+        return changed
+
+    def compile_ignore_hosts(self):
+        networks = list(PRIVATE_NETWORKS) if Config.pac.bypass_private else []
+        if Config.pac.bypass_networks:
+            networks.extend(load_networks(Config.pac.bypass_networks))
+        pac = Pac(Config)
+        pac.fetch_user_rules()
+        return compile_ignore_hosts(
+            pac.parse().rule_groups(),
+            networks,
+            Config.pac.bypass_limit
+        )
+
+    def _on_bypass(self, hosts, error):
+        if error:
+            return
+        proxy = SystemProxy.get()
+        proxy.set_ignore_hosts(hosts)
+        proxy.apply_ignore_hosts()
+
+    def rebuild_pac(self):
+        def rebuild():
             pac = Pac(Config)
-            pac.fetch_remote_gfwlist()
             pac.fetch_user_rules()
             if pac.generate().save():
-                self.notify.show(_('Successful to update gfwlist'))
-                return True
-            self.notify.show(_('Failed to update gfwlist'))
-        return AsyncCall(func, None)
+                self.pac_server.reload()
+                self.load_router(pac)
+                self.logger.info(_('Success to generate pac file.'))
+            return True
+        return AsyncCall(rebuild)
+
+    def _on_config_changed(self, kind, name, action):
+        if kind == 'rules' or (kind, name) == ('section', 'pac'):
+            self.rebuild_pac()
+        elif kind == 'server' and action == 'added':
+            self._append_servers([name])
+        elif kind == 'server' and action == 'removed':
+            self._remove_servers([name])
+        elif kind == 'server' and self.window:
+            self._append_servers([name])
+            selection = self.builder.get_object('ServerSelection')
+            self.handler.on_selected_server_changed(selection)
+
+    def _on_pac_updated(self, result, error):
+        if error:
+            self.notify.show(_('Failed to update gfwlist'), 'pac')
+
+    def wants_connection(self):
+        auto_reconnect = GLib.Variant.parse(
+            None, Config.application.auto_reconnect, None, None
+        )
+        if not auto_reconnect.unpack():
+            return False
+        if self.window:
+            return self.builder.get_object('ConnectionControl').get_state()
+        return self._auto_connect_state()
+
+    def probe_servers(self):
+        if not self.server_list:
+            return False
+        return self.server_list.probe(
+            Config.servers,
+            workers=Config.application.probe_workers
+        )
+
+    def on_reconnect(self):
+        self.notify.show(_('Connection lost, reconnecting..'), 'reconnect')
+
+    def _schedule_jobs(self):
+        self.schedule_common_jobs(self._on_pac_updated)
+        self.scheduler.add(
+            'subscriptions',
+            self.check_subscriptions,
+            interval=Config.application.subscription_interval,
+            retry=Config.pac.update_retry,
+            threaded=True,
+            callback=self._on_subscriptions_checked,
+            prepare=self._subscriptions_snapshot,
+            delay=due_in(
+                Config.application.subscription_interval,
+                last_checked(Config)
+            ) if Config.application.subscriptions else None
+        )
+        self.scheduler.add(
+            'probe',
+            self.probe_servers,
+            interval=Config.application.probe_interval,
+            threaded=True,
+            delay=5
+        )
 
     def do_set_proxy(self, action, state):
         action.set_state(state)
-        self.logger.info(_('Now proxy type is: {}').format(state))
+        self.logger.info(_('Now proxy type is: %s'), state)
         Config.application.proxy_type = state.print_(True)
-        Config.save_application()
+        Config.defer('application')
         self._set_proxy(state.unpack())
         return True
 
     def _set_proxy(self, _type='auto'):
         if _type == 'auto':
-            return SystemProxy().by_pac(Config.pac.path)
+            return SystemProxy.get().by_pac(self.pac_url)
         elif _type == 'global':
-            # TODO: get proxy setting
-            return SystemProxy().global_proxy()
+            socks = (Config.local.address, int(Config.local.port))
+            http = self.http_proxy.address \
+                if self.http_proxy.serving else None
+            AsyncCall(self.compile_ignore_hosts, callback=self._on_bypass)
+            return SystemProxy.get().global_proxy(socks, http)
         elif _type == 'none':
-            return SystemProxy().none_proxy()
+            return SystemProxy.get().none_proxy()
         raise TypeError(_('Unknown proxy type: {}').format(_type))
 
-    def _auto_connect(self):
+    @property
+    def pac_url(self):
+        if self.pac_server.serving:
+            return self.pac_server.url
+        return 'file://' + Config.pac.path
+
+    def _auto_connect_state(self):
         auto_connect = Config.application.auto_connect
-        auto_connect = GLib.Variant.parse(None, auto_connect, None, None)
-        if auto_connect.unpack():
-            self.builder.get_object('ConnectionControl').set_state(True)
+        return GLib.Variant.parse(None, auto_connect, None, None).unpack()
+
+    def _auto_connect(self):
+        if self._auto_connect_state():
+            if self.window:
+                self.builder.get_object('ConnectionControl').set_state(True)
+            elif not self.sslocal.pending:
+                AsyncCall(self.sslocal.control, 'start')
             proxy_type = Config.application.proxy_type
             return self._set_proxy(
                 GLib.Variant.parse(None, proxy_type, None, None).unpack()
             )
         return AsyncCall(self.sslocal.control, 'stop')
 
-    def create_notification(self):
-        self.register()
-        self.notification = Gio.Notification.new(self.get_application_id())
-        self.notification.set_body('Startup.')
-        icon = Gio.ThemedIcon.new('network-vpn-symbolic')
-        self.notification.set_icon(icon)
-        self.send_notification('state', self.notification)
-
     def create_menu_view(self):
         self.menu = Gtk.Menu()
         quit = Gtk.MenuItem('Quit')
@@ -177,26 +495,20 @@ class Shadowsocks(Gtk.Application):
 
     def create_server_view(self):
         self.logger.debug(_('Load view of server list..'))
-        server_list = Gtk.ListStore(str)
-        for server in Config.servers.keys():
-            server_list.append([server])
-            self.logger.debug(
-                _('Append server<{}> to server list.').format(server)
-            )
+        self.server_list = ServerList()
+        self.server_list.load(Config.servers)
         server_view = self.builder.get_object('ServerListView')
-        server_view.set_model(server_list)
+        self.server_list.create_columns(server_view)
         self.builder.get_object('ServerSelection').select_path(Gtk.TreePath(0))
-        cell = Gtk.CellRendererText()
-        column = Gtk.TreeViewColumn(_('_Server_List'), cell, text=0)
-        server_view.append_column(column)
         self.logger.debug(_('Server list loaded.'))
 
-    def create_supported_method_view(self):
+    def create_supported_method_view(self, builder=None):
+        builder = builder or self.builder
         self.logger.debug(_('Loading view of crypt methods.'))
         method_list = Gtk.ListStore(str)
         for method in self.methods:
             self.methods_map[method] = method_list.append([method])
-        crypt_method_combo = self.builder.get_object("CryptMethodCombo")
+        crypt_method_combo = builder.get_object("CryptMethodCombo")
         crypt_method_combo.set_model(method_list)
         cell = Gtk.CellRendererText()
         crypt_method_combo.pack_start(cell, True)
@@ -214,13 +526,21 @@ class Shadowsocks(Gtk.Application):
         proxy_type = Config.application.proxy_type \
             if Config.application.proxy_type is not None else "'none'"
         proxy_radio.set_state(GLib.Variant.parse(None, proxy_type, None, None))
-        self.logger.debug(_('Proxy type from config: {}').format(proxy_type))
+        self.logger.debug(_('Proxy type from config: %s'), proxy_type)
 
     def _signal_for_pac_menu(self):
         action = Gio.SimpleAction.new('update_pac', None)
         action.connect('activate', self.do_update_pac)
         self.add_action(action)
 
+    def _signal_for_debug_menu(self):
+        action = Gio.SimpleAction.new('dump_stats', None)
+        action.connect('activate', self.do_dump_stats)
+        self.add_action(action)
+        instrument = Config.application.get('instrument', 'false')
+        if GLib.Variant.parse(None, instrument, None, None).unpack():
+            stats.enable(profile=self._profile_state())
+
     def _signal_for_connection_menu(self):
         var_false = GLib.Variant.new_boolean(False)
         for signal, callback in self._signals.items():
@@ -228,7 +548,7 @@ class Shadowsocks(Gtk.Application):
             action.connect('change-state', getattr(self, callback))
             self.add_action(action)
             state = Config.application.get(signal, 'false')
-            self.logger.debug(_('{} from config: {}').format(signal, state))
+            self.logger.debug(_('%s from config: %s'), signal, state)
             action.set_state(GLib.Variant.parse(None, state, None, None))
 
 
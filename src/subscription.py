@@ -0,0 +1,411 @@
+# coding: utf8
+
+import io
+import json
+import time
+import base64
+import binascii
+import logging
+
+from urllib.parse import quote, unquote, urlsplit, parse_qs
+
+from .config import ConfigItem
+
+logger = logging.getLogger(__name__)
+
+
+class SubscriptionError(ValueError):
+    pass
+
+
+def b64decode(text):
+    text = text.strip().replace('-', '+').replace('_', '/')
+    text += '=' * (-len(text) % 4)
+    return base64.b64decode(text)
+
+
+def b64encode(data, urlsafe=False):
+    if urlsafe:
+        return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+    return base64.b64encode(data).decode('ascii')
+
+
+def make_server(server, port, method, password, **extra):
+    config = ConfigItem(
+        server=server,
+        server_port=int(port),
+        password=password,
+        method=method,
+        timeout=300,
+        fast_open=False
+    )
+    config.update((k, v) for k, v in extra.items() if v is not None)
+    return config
+
+
+def parse_uri(uri):
+    """Parse a ``ss://`` uri, in SIP002 or the legacy base64 form.
+
+    Returns ``(name, config)``, name is None when the uri has no tag.
+    """
+    if not uri.startswith('ss://'):
+        raise SubscriptionError('Not a ss:// uri: {}'.format(uri[:32]))
+    body, _, tag = uri[5:].partition('#')
+    name = unquote(tag).strip() or None
+
+    try:
+        if '@' in body:
+            url = urlsplit('ss://' + body)
+            userinfo = unquote(url.username or '')
+            if ':' not in userinfo:
+                userinfo = b64decode(userinfo).decode('utf8')
+            method, password = userinfo.split(':', 1)
+            plugin = parse_qs(url.query).get('plugin', [None])[0]
+            host, port = url.hostname, url.port
+        else:
+            body = body.split('/?', 1)[0]
+            decoded = b64decode(body).decode('utf8')
+            userinfo, _, address = decoded.rpartition('@')
+            method, password = userinfo.split(':', 1)
+            host, port = address.rsplit(':', 1)
+            host = host.strip('[]')
+            plugin = None
+    except (ValueError, binascii.Error, UnicodeDecodeError) as e:
+        raise SubscriptionError('Bad ss:// uri: {}'.format(e))
+    if not host or not port:
+        raise SubscriptionError('ss:// uri without address')
+
+    if plugin:
+        plugin, _, plugin_opts = plugin.partition(';')
+        return name, make_server(host, port, method, password,
+                                 plugin=plugin, plugin_opts=plugin_opts)
+    return name, make_server(host, port, method, password)
+
+
+def parse_sip008(document):
+    if isinstance(document, (str, bytes)):
+        document = json.loads(document)
+    for server in document.get('servers', []):
+        yield server.get('remarks') or None, make_server(
+            server['server'],
+            server['server_port'],
+            server['method'],
+            server['password'],
+            plugin=server.get('plugin') or None,
+            plugin_opts=server.get('plugin_opts') or None
+        )
+
+
+def iter_servers(lines):
+    """Parse a subscription body lazily, line by line.
+
+    The body may be a SIP008 json document, a list of ss:// uris, or
+    such a list encoded with base64.
+    """
+    lines = iter(lines)
+    for first in lines:
+        first = first.strip()
+        if first:
+            break
+    else:
+        return
+
+    if first.startswith('{'):
+        document = first + ''.join(lines)
+        yield from parse_sip008(document)
+        return
+
+    if not first.startswith('ss://'):
+        try:
+            decoded = b64decode(first + ''.join(x.strip() for x in lines))
+        except (ValueError, binascii.Error) as e:
+            raise SubscriptionError('Unknown subscription format: {}'.format(e))
+        yield from iter_servers(io.StringIO(decoded.decode('utf8')))
+        return
+
+    yield _parse_line(first)
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield _parse_line(line)
+
+
+def _parse_line(line):
+    try:
+        return parse_uri(line)
+    except SubscriptionError as e:
+        logger.warning('Skip %s', e)
+        return None, None
+
+
+def open_source(source, timeout=30, headers=None):
+    """Lines of a subscription from a local file or an http(s) url."""
+    if source.startswith('http://') or source.startswith('https://'):
+        import requests
+        response = requests.get(source, timeout=timeout, stream=True,
+                                headers=headers)
+        response.raise_for_status()
+        response.encoding = response.encoding or 'utf8'
+        return response.iter_lines(decode_unicode=True)
+    return open(source, encoding='utf8')
+
+
+def server_key(config):
+    return (
+        config.get('server'), int(config.get('server_port', 0)),
+        config.get('method'), config.get('password')
+    )
+
+
+def unique_name(name, taken):
+    if name not in taken:
+        return name
+    n = 2
+    while '{} ({})'.format(name, n) in taken:
+        n += 1
+    return '{} ({})'.format(name, n)
+
+
+def collect(lines, existing=None):
+    """Deduplicated ``{name: config}`` of a subscription body.
+
+    Servers already in ``existing``, by address and credentials, are
+    skipped; names are made unique against ``existing`` too.
+    """
+    return merge(
+        (item for item in iter_servers(lines) if item[1] is not None),
+        existing
+    )
+
+
+def merge(items, existing=None):
+    """``collect`` of ``(name, config)`` pairs instead of lines."""
+    existing = existing or {}
+    seen = set(server_key(c) for c in existing.values())
+    taken = set(existing)
+    servers = {}
+    for name, config in items:
+        key = server_key(config)
+        if key in seen:
+            continue
+        seen.add(key)
+        name = unique_name(
+            (name or '{}:{}'.format(config.server, config.server_port))
+            .replace('/', '_'),
+            taken
+        )
+        taken.add(name)
+        servers[name] = config
+    return servers
+
+
+def fetch_servers(source, existing=None):
+    """The servers of ``source`` that are not in ``existing``.
+
+    Only reads, so it can run in a worker thread against a copy of the
+    servers; ``import_servers`` adds the result.
+    """
+    lines = open_source(source)
+    try:
+        return collect(lines, existing)
+    finally:
+        close = getattr(lines, 'close', None)
+        if close:
+            close()
+
+
+def import_servers(config, servers):
+    """Add fetched ``servers`` to ``config`` and return their names.
+
+    Servers and names are checked against ``config`` again, which may
+    have changed while they were fetched. Saving is left to the caller.
+    """
+    servers = merge(servers.items(), config.servers)
+    config.servers.update(servers)
+    logger.info('Imported %s servers', len(servers))
+    return list(servers)
+
+
+LOCAL_KEYS = ('enabled', 'subscription')
+
+
+class ServerDiff:
+    """Changes between the stored and the fetched servers of a subscription.
+    """
+
+    def __init__(self, url, etag=None, modified=None):
+        self.url = url
+        self.etag = etag
+        self.modified = modified
+        self.added = {}
+        self.changed = {}
+        self.removed = []
+
+    def __bool__(self):
+        return bool(self.added or self.changed or self.removed)
+
+    def __repr__(self):
+        return '<ServerDiff {} +{} ~{} -{}>'.format(
+            self.url, len(self.added), len(self.changed), len(self.removed)
+        )
+
+
+def fetch(url, etag=None, modified=None, timeout=30):
+    """Conditionally fetch a subscription body.
+
+    Returns ``(lines, etag, modified)``; lines is None when the
+    subscription was not modified since ``etag``/``modified``.
+    """
+    import requests
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if modified:
+        headers['If-Modified-Since'] = modified
+    response = requests.get(url, headers=headers, timeout=timeout)
+    if response.status_code == 304:
+        return None, etag, modified
+    response.raise_for_status()
+    return (
+        response.text.splitlines(),
+        response.headers.get('ETag'),
+        response.headers.get('Last-Modified')
+    )
+
+
+def _differs(old, new):
+    keys = (set(old) | set(new)) - set(LOCAL_KEYS)
+    return any(old.get(k) != new.get(k) for k in keys)
+
+
+def address_key(config):
+    return (
+        config.get('server'), int(config.get('server_port', 0)),
+        config.get('method')
+    )
+
+
+def diff_servers(servers, url, lines, etag=None, modified=None):
+    """Diff the servers of subscription ``url`` against a fetched body.
+
+    A fetched server with the address of a server without subscription,
+    e.g. one imported by hand from ``url`` before, takes that server
+    over instead of being added again.
+    """
+    diff = ServerDiff(url, etag, modified)
+    current = {}
+    others = set()
+    untagged = {}
+    for name in servers:
+        subscription = servers[name].get('subscription')
+        if subscription == url:
+            current[name] = servers[name]
+        else:
+            others.add(name)
+            if not subscription:
+                untagged.setdefault(address_key(servers[name]), name)
+
+    taken = set(others)
+    for name, config in collect(lines).items():
+        config.subscription = url
+        if name not in current:
+            adopted = untagged.pop(address_key(config), None)
+            if adopted is not None:
+                if 'enabled' in servers[adopted]:
+                    config.enabled = servers[adopted]['enabled']
+                diff.changed[adopted] = config
+                continue
+        if name in others:
+            name = unique_name(name, taken)
+        taken.add(name)
+        if name not in current:
+            diff.added[name] = config
+        elif _differs(current[name], config):
+            for key in LOCAL_KEYS:
+                if key in current[name]:
+                    config[key] = current[name][key]
+            diff.changed[name] = config
+    diff.removed = [name for name in current if name not in taken]
+    return diff
+
+
+def check_subscription(servers, subscription):
+    lines, etag, modified = fetch(
+        subscription['url'],
+        subscription.get('etag'),
+        subscription.get('modified')
+    )
+    if lines is None:
+        logger.debug('Subscription %s is not modified', subscription['url'])
+        return ServerDiff(subscription['url'], etag, modified)
+    return diff_servers(servers, subscription['url'], lines, etag, modified)
+
+
+def apply_diff(config, diff):
+    """Apply ``diff`` to ``config.servers`` in memory."""
+    config.servers.update(diff.added)
+    config.servers.update(diff.changed)
+    for name in diff.removed:
+        config.servers.pop(name, None)
+    for subscription in config.application.get('subscriptions', []):
+        if subscription['url'] == diff.url:
+            subscription['etag'] = diff.etag
+            subscription['modified'] = diff.modified
+            subscription['checked'] = time.time()
+
+
+def last_checked(config):
+    """Unix time of the least recently checked subscription.
+
+    None when one was never checked.
+    """
+    checked = [s.get('checked')
+               for s in config.application.get('subscriptions', [])]
+    if not checked or None in checked:
+        return None
+    return min(checked)
+
+
+def save_diff(config, diff):
+    config.save_servers(list(diff.added) + list(diff.changed))
+    config.delete_servers(diff.removed)
+
+
+def to_uri(name, config):
+    userinfo = b64encode(
+        '{}:{}'.format(config.method, config.password).encode('utf8'),
+        urlsafe=True
+    )
+    host = config.server
+    if ':' in host:
+        host = '[{}]'.format(host)
+    uri = 'ss://{}@{}:{}'.format(userinfo, host, config.server_port)
+    if config.get('plugin'):
+        plugin = config.plugin
+        if config.get('plugin_opts'):
+            plugin += ';' + config.plugin_opts
+        uri += '/?plugin=' + quote(plugin)
+    return uri + '#' + quote(name)
+
+
+def export_servers(servers, format='sip008'):
+    """Serialize ``{name: config}`` as 'sip008', 'uri' or 'base64'."""
+    if format == 'sip008':
+        return json.dumps(dict(version=1, servers=[
+            dict(
+                id=name,
+                remarks=name,
+                server=config.server,
+                server_port=int(config.server_port),
+                password=config.password,
+                method=config.method,
+                **{k: config[k] for k in ('plugin', 'plugin_opts')
+                   if config.get(k)}
+            ) for name, config in servers.items()
+        ]), indent=2)
+    uris = '\n'.join(to_uri(name, c) for name, c in servers.items())
+    if format == 'uri':
+        return uris
+    if format == 'base64':
+        return b64encode(uris.encode('utf8'))
+    raise SubscriptionError('Unknown export format: {}'.format(format))
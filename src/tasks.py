@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import time
+import random
 import logging
 import threading
 
@@ -8,6 +9,8 @@ from gi.repository import GLib
 
 from gettext import gettext as _
 
+from .instrument import measure, count
+
 
 class AsyncCall:
     def __init__(self, func, *args, callback=None):
@@ -25,56 +28,207 @@ class AsyncCall:
         result = error = None
 
         try:
-            self.logger.info(
-                _('Task<{}> with args<{}> is starting').format(
-                    self._func.__name__,
-                    self._args
-                )
+            self.logger.debug(
+                _('Task<%s> with args<%s> is starting'),
+                self._func.__name__,
+                self._args
             )
-            result = self._func(*self._args)
-            self.logger.info(
-                _('Task<{}> with args<{}> is completed').format(
-                    self._func.__name__,
-                    self._args
-                )
+            with measure('task.' + self._func.__name__):
+                result = self._func(*self._args)
+            self.logger.debug(
+                _('Task<%s> with args<%s> is completed'),
+                self._func.__name__,
+                self._args
             )
             self.logger.debug(
-                _('Result of Task<{}> is: {}').format(
-                    self._func.__name__,
-                    result
-                )
+                _('Result of Task<%s> is: %s'), self._func.__name__, result
             )
         except Exception as e:
             self.logger.error(
-                _('An error occured when Task<{}> is running.').format(
-                    self._func.__name__
-                )
+                _('An error occured when Task<%s> is running.'),
+                self._func.__name__
             )
             self.logger.exception(e)
+            count('task.errors')
             error = e
 
         if self._callback:
             GLib.idle_add(self._callback, result, error)
 
 
-class AsyncDaemon:
+class Job:
+    """A named periodic job driven by the GLib main loop.
 
-    def __init__(self, func, *args, callback=None, sleep=2):
-        self._stopped = False
+    Every tick is a one-shot ``GLib.timeout_add_seconds`` source which is
+    re-armed after the job finishes, so ticks missed while the job was
+    running (or the machine was suspended) are coalesced into one run.
+    When ``retry`` is given, failed runs are retried after an exponential
+    backoff starting at ``retry`` seconds and capped at ``interval``.
+    ``prepare`` is called on the main loop at every run and its result
+    passed to ``func`` as the last argument, e.g. a copy of the state a
+    threaded job must not touch.
+    """
+
+    def __init__(self, name, func, *args, interval=60, jitter=0.1,
+                 threaded=False, callback=None, retry=None, prepare=None):
+        self.logger = logging.getLogger(__name__)
+
+        self.name = name
+        self.interval = interval
+        self.jitter = jitter
+        self.threaded = threaded
+        self.retry = retry
 
         self._func = func
         self._args = args
-        self._sleep = sleep
         self._callback = callback
+        self._prepare = prepare
+
+        self._source = None
+        self._running = False
+        self._stopped = True
+
+        self.runs = 0
+        self.failures = 0
+        self.last_run = None
+
+    @property
+    def running(self):
+        return self._running
+
+    def next_delay(self):
+        interval = self.interval
+        if self.failures and self.retry:
+            interval = min(self.retry * 2 ** (self.failures - 1), interval)
+        jitter = interval * self.jitter
+        delay = interval + random.uniform(-jitter, jitter)
+        return max(1, int(round(delay)))
 
-    def run(self):
-        while not self._stopped:
-            GLib.idle_add(self._func, *self._args)
+    def start(self, delay=None):
+        self._stopped = False
+        self._schedule(self.next_delay() if delay is None else delay)
 
     def stop(self):
         self._stopped = True
+        if self._source is not None:
+            GLib.source_remove(self._source)
+            self._source = None
+
+    def run_now(self):
+        if self._source is not None:
+            GLib.source_remove(self._source)
+            self._source = None
+        self._tick()
+
+    def _schedule(self, delay):
+        if self._stopped or self._source is not None:
+            return
+        if delay <= 0:
+            self._source = GLib.idle_add(self._tick)
+        else:
+            self._source = GLib.timeout_add_seconds(delay, self._tick)
+        self.logger.debug(_('Job<%s> is scheduled in %ss'), self.name, delay)
+
+    def _tick(self):
+        self._source = None
+        if self._stopped:
+            return False
+        if self._running:
+            self.logger.debug(
+                _('Job<%s> is still running, tick coalesced'), self.name
+            )
+            return False
+
+        self._running = True
+        self.runs += 1
+        self.last_run = time.monotonic()
+        args = self._args
+        if self._prepare:
+            args += (self._prepare(),)
+        if self.threaded:
+            AsyncCall(self._func, *args, callback=self._done)
+            return False
 
-    def start(self):
-        thread = threading.Thread(target=self.run)
-        thread.daemon = True
-        thread.start()
+        result = error = None
+        try:
+            with measure('job.' + self.name):
+                result = self._func(*args)
+        except Exception as e:
+            self.logger.exception(e)
+            error = e
+        self._done(result, error)
+        return False
+
+    def _done(self, result, error):
+        self._running = False
+        if error is None:
+            self.failures = 0
+        else:
+            self.failures += 1
+        delay = None
+        if self._callback:
+            delay = self._callback(result, error)
+        self._schedule(self.next_delay() if delay is None else delay)
+        return False
+
+
+def due_in(interval, last, now=None):
+    """Seconds until a job last run at ``last``, a unix time, is due.
+
+    0 when it never ran or is overdue, so restarts do not postpone runs
+    by a whole ``interval``.
+    """
+    if last is None:
+        return 0
+    if now is None:
+        now = time.time()
+    return max(0, int(interval - (now - last)))
+
+
+class Scheduler:
+    """Keeps the named periodic jobs of the application."""
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._jobs = {}
+
+    def __contains__(self, name):
+        return name in self._jobs
+
+    def __getitem__(self, name):
+        return self._jobs[name]
+
+    def add(self, name, func, *args, interval=60, jitter=0.1, threaded=False,
+            callback=None, retry=None, delay=None, prepare=None):
+        self.remove(name)
+        job = Job(
+            name, func, *args,
+            interval=interval,
+            jitter=jitter,
+            threaded=threaded,
+            callback=callback,
+            retry=retry,
+            prepare=prepare
+        )
+        self._jobs[name] = job
+        job.start(delay)
+        self.logger.debug(
+            _('Job<%s> is added with interval %ss'), name, interval
+        )
+        return job
+
+    def remove(self, name):
+        job = self._jobs.pop(name, None)
+        if job:
+            job.stop()
+            self.logger.debug(_('Job<%s> is removed'), name)
+        return job
+
+    def run_now(self, name):
+        return self._jobs[name].run_now()
+
+    def stop(self):
+        for job in self._jobs.values():
+            job.stop()
+        self._jobs.clear()
+        self.logger.debug(_('Scheduler is stopped'))
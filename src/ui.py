@@ -0,0 +1,81 @@
+# coding: utf8
+
+import os
+import re
+import logging
+
+from gi.repository import Gtk
+
+RESOURCES = os.path.join(os.path.dirname(__file__), 'resources')
+
+
+class LazyBuilder:
+    """A ``Gtk.Builder`` whose ui fragments are built on first use.
+
+    Every fragment is a ``.ui`` file of the resources directory. Object
+    ids are indexed with a plain text scan, so nothing is parsed by Gtk
+    until ``get_object`` asks for an id of a fragment. Fragments listed in
+    ``depends`` are built first, as their objects are referenced by id,
+    e.g. a dialog being ``transient_for`` the main window.
+    """
+
+    fragments = ('main', 'menu-popover', 'server-dialog', 'preference')
+    depends = {
+        'menu-popover': ('main',),
+        'server-dialog': ('main',),
+        'preference': ('main',),
+    }
+    _id = re.compile(r'<object class="[^"]+" id="([^"]+)"')
+
+    def __init__(self, handler=None, domain=None, path=RESOURCES):
+        self.logger = logging.getLogger(__name__)
+        self.builder = Gtk.Builder()
+        if domain:
+            self.builder.set_translation_domain(domain)
+        self.handler = handler
+        self.path = path
+        self._index = None
+        self._loaded = set()
+        self._hooks = {}
+
+    def filename(self, fragment):
+        return os.path.join(self.path, fragment + '.ui')
+
+    def index(self):
+        if self._index is None:
+            self._index = {}
+            for fragment in self.fragments:
+                with open(self.filename(fragment), encoding='utf8') as ui:
+                    for object_id in self._id.findall(ui.read()):
+                        self._index[object_id] = fragment
+        return self._index
+
+    def on_load(self, fragment, callback):
+        """Call ``callback(builder)`` once ``fragment`` is built."""
+        if fragment in self._loaded:
+            callback(self)
+        else:
+            self._hooks.setdefault(fragment, []).append(callback)
+
+    def is_loaded(self, fragment):
+        return fragment in self._loaded
+
+    def load(self, fragment):
+        if fragment in self._loaded:
+            return
+        for dependency in self.depends.get(fragment, ()):
+            self.load(dependency)
+        self._loaded.add(fragment)
+        self.builder.add_from_file(self.filename(fragment))
+        if self.handler is not None:
+            self.builder.connect_signals(self.handler)
+        self.logger.debug('Load ui fragment<%s>', fragment)
+        for callback in self._hooks.pop(fragment, []):
+            callback(self)
+
+    def get_object(self, name):
+        fragment = self.index().get(name)
+        if fragment is None:
+            return None
+        self.load(fragment)
+        return self.builder.get_object(name)